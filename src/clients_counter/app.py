@@ -2,8 +2,8 @@ from logging import getLogger, INFO
 import os
 
 from lib.clients_counter import (
-    ClientsCounter,
     CountCommandFromCloudWatchLogsToDynamoDB,
+    CountConfig,
 )
 
 
@@ -14,12 +14,25 @@ table_name = os.getenv('TABLE_NAME')
 primary_key_column_name = os.getenv('PRIMARY_KEY_COLUMN_NAME', 'id')
 
 
-def handler(event, context):
-    clients_counter = ClientsCounter(
-        command_class=CountCommandFromCloudWatchLogsToDynamoDB,
-        event=event,
-        table_name=table_name,
-        primary_key_column_name=primary_key_column_name
-    )
+def build_handler(command_class, config):
+    """
+    コマンドと設定をLambda実行環境の起動時に固定したハンドラーを生成する.
 
-    clients_counter.count()
+    Notes
+    -----
+    呼出しごとに変化するのはイベントのみのため、 ClientsCounter を経由せずにコマンドを直接生成する。
+
+    """
+    def handler(event, context):
+        command = command_class(event=event, config=config)
+
+        if command.check_event_source():
+            command.count()
+
+    return handler
+
+
+handler = build_handler(
+    CountCommandFromCloudWatchLogsToDynamoDB,
+    CountConfig(table_name=table_name, primary_key_column_name=primary_key_column_name)
+)
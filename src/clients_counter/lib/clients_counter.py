@@ -1,21 +1,93 @@
 import base64
+from dataclasses import dataclass, fields
 from datetime import datetime, timedelta
 from enum import Enum, auto
-import gzip
-import itertools
 import json
 from logging import getLogger, INFO
 import re
+import time
+from typing import Optional
+import zlib
 
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
 
 logger = getLogger(__name__)
 logger.setLevel(INFO)
 
-cw = boto3.client('cloudwatch')
-dynamodb = boto3.client('dynamodb')
+# ウォーム状態のLambda実行環境で接続を使い回すため、クライアントはモジュール読込時に1度だけ生成する
+boto3_config = Config(
+    connect_timeout=1,
+    read_timeout=3,
+    retries={'max_attempts': 3, 'mode': 'adaptive'},
+    max_pool_connections=50,
+)
+
+cw = boto3.client('cloudwatch', config=boto3_config)
+dynamodb = boto3.client('dynamodb', config=boto3_config)
+
+# メトリクスは1分単位で更新されるため、直前の値はウォーム状態のLambda実行環境内で短時間キャッシュする
+# (metric_namespace, metric_name) をキーとし、 (取得時刻, 値) を保持する
+previous_metric_cache = {}
+PREVIOUS_METRIC_CACHE_SECONDS = 55
+
+# SNSからの状態変化理由の文字列における `[1.0 (01/08/22 15:05:00)]` 部分の数値を抽出する
+DATAPOINT_PATTERN = re.compile(r'\[([0-9.-]+)\s*\([^)]*\)\]')
+
+# Minecraftサーバーのログ `[15:31:00] [Server thread/INFO]: user joined the game` から接続状態を1回の走査で判定する
+LOG_STATE_PATTERN = re.compile(r'(joined|left) the game')
+
+
+def json_loads(s):
+    """orjson が利用可能であれば orjson で、それ以外は標準ライブラリの json でデコードする."""
+    if orjson is not None:
+        return orjson.loads(s)
+    return json.loads(s)  # pragma: no cover
+
+
+def json_dumps(obj):
+    """orjson が利用可能であれば orjson で、それ以外は標準ライブラリの json で空白を含めずにエンコードする."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(',', ':'))  # pragma: no cover
+
+
+@dataclass(frozen=True)
+class CountConfig:
+    """
+    接続ユーザー数カウント時に利用する、呼出しごとに変化しない設定.
+
+    Notes
+    -----
+    環境変数から読込む設定はLambda実行環境の起動時に1度だけ生成し、各呼出しで使い回す。
+    コマンドにはキーワード引数 config として渡すか、各設定値をキーワード引数として直接渡す。
+
+    Examples
+    --------
+    >>> config = CountConfig(table_name='SampleTable', primary_key_column_name='id')
+    >>> command = CountCommandFromCloudWatchLogsToDynamoDB(event=event, config=config)
+
+    """
+    table_name: Optional[str] = None
+    primary_key_column_name: Optional[str] = None
+    joined_alarm_name: Optional[str] = None
+    left_alarm_name: Optional[str] = None
+    metric_namespace: Optional[str] = None
+    metric_name: Optional[str] = None
+
+    @classmethod
+    def from_kwargs(cls, kwargs):
+        if kwargs.get('config') is not None:
+            return kwargs['config']
+
+        return cls(**{f.name: kwargs[f.name] for f in fields(cls) if f.name in kwargs})
 
 
 class ClientsCounter:
@@ -25,7 +97,7 @@ class ClientsCounter:
     ----------
     command : CountCommand
         接続ユーザー数カウント時に利用するコマンド。
-        設定時にはクラス名を直接セットする。
+        生成時に command_class で指定したクラスを、キーワード引数で初期化して保持する。
 
     Examples
     --------
@@ -37,17 +109,10 @@ class ClientsCounter:
     >>> clients_counter.count()
 
     """
-    def __init__(self, command_class=None, **kwargs):
-        self._kwargs = kwargs
-        self.command = command_class or CountCommand
-
-    @property
-    def command(self):
-        return self._command
+    __slots__ = ('command',)
 
-    @command.setter
-    def command(self, command_class):
-        self._command = command_class(**self._kwargs)
+    def __init__(self, command_class=None, **kwargs):
+        self.command = (command_class or CountCommand)(**kwargs)
 
     def count(self):
         if self.command.check_event_source():
@@ -67,63 +132,72 @@ class CountCommand:
 
 class CountCommandFromCloudWatchLogsToDynamoDB:
     def __init__(self, **kwargs):
+        config = CountConfig.from_kwargs(kwargs)
         self.event = kwargs['event']
-        self.table = CounterTable(kwargs.get('table_name'), kwargs.get('primary_key_column_name'))
+        self.table = CounterTable(config.table_name, config.primary_key_column_name)
 
     def count(self):
+        deltas = [LOG_STATE_DELTAS[s] for s in self.iter_log_states() if s in LOG_STATE_DELTAS]
+
+        if not deltas:
+            return []
+
+        # BatchWriteItem は UpdateItem に対応していないため、増減を相殺した値で1回だけ更新する
+        # 各イベント時点の接続ユーザー数は、更新後の値から逆算する
+        total = sum(deltas)
+        connected_count = self.table.update_item(total) - total
         results = []
 
-        for state in itertools.chain.from_iterable(self.analyze_log_text()):
-            if state == LogState.JOINED:
-                result = self.table.update_item(1)
-                logger.info(json.dumps({
-                    'connected_count': result,
-                    'joined_count': 1,
-                    'left_count': 0,
-                }))
-                results.append(result)
-            elif state == LogState.LEFT:
-                result = self.table.update_item(-1)
-                logger.info(json.dumps({
-                    'connected_count': result,
-                    'joined_count': 0,
-                    'left_count': 1,
-                }))
-                results.append(result)
+        for delta in deltas:
+            connected_count += delta
+            logger.info('%s', LazyJSONMessage({
+                'connected_count': connected_count,
+                'joined_count': 1 if delta > 0 else 0,
+                'left_count': 1 if delta < 0 else 0,
+            }))
+            results.append(connected_count)
 
         return results
 
-    def analyze_log_text(self):
-        decoded = self.decode_event_records()
-        logger.info(json.dumps(decoded))
-
-        results_list = []
-        for record in decoded['Records']:
-            results = []
-            for log_event in record['kinesis']['data']['logEvents']:
-                if 'joined' in log_event['message']:
-                    results.append(LogState.JOINED)
-                elif 'left' in log_event['message']:
-                    results.append(LogState.LEFT)
-                elif log_event['message'].startswith('CWL CONTROL MESSAGE'):
-                    logger.info(log_event['message'])
-                    results.append(LogState.INITIAL_ACTIVATION_OF_KINESIS_DATA_STREAM)
-                else:
-                    raise UnknownLogState
-            results_list.append(results)
-
-        return results_list
-
-    def decode_event_records(self):
-        decoded = self.event | {
-            'Records': [
-                r | {
-                    'kinesis': {'data': json.loads(gzip.decompress(base64.b64decode(r['kinesis']['data'].encode())))}
-                } for r in self.event['Records']
-            ]
-        }
-
-        return decoded
+    def iter_log_states(self):
+        """
+        Kinesisレコードを1件ずつデコードしながら、ログイベントの状態を順に返す.
+
+        Notes
+        -----
+        デコード済みのイベント全体を生成せず、デコードしたレコードのデータはレコードごとに1行ずつログ出力する。
+
+        Yields
+        ------
+        state : LogState
+            ログイベントの状態。
+
+        """
+        for record in self.event['Records']:
+            yield from self._analyze_log_events(self._decode_record_data(record))
+
+    def _decode_record_data(self, record):
+        # gzip.decompress はファイルオブジェクトを経由するため、 zlib で直接gzip形式 (wbits=31) を展開する
+        return json_loads(zlib.decompress(base64.b64decode(record['kinesis']['data']), 31))
+
+    def _analyze_log_events(self, data):
+        logger.info('%s', LazyJSONMessage(data))
+
+        for log_event in data['logEvents']:
+            message = log_event['message']
+
+            if message.startswith('CWL CONTROL MESSAGE'):
+                logger.info(message)
+                yield LogState.INITIAL_ACTIVATION_OF_KINESIS_DATA_STREAM
+                continue
+
+            matched = LOG_STATE_PATTERN.search(message)
+            if matched is None:
+                raise UnknownLogState
+            elif matched.group(1) == 'joined':
+                yield LogState.JOINED
+            else:
+                yield LogState.LEFT
 
     def check_event_source(self):
         try:
@@ -134,19 +208,20 @@ class CountCommandFromCloudWatchLogsToDynamoDB:
 
 class CountCommandFromCloudWatchAlarmToDynamoDB(CountCommand):
     def __init__(self, **kwargs):
+        config = CountConfig.from_kwargs(kwargs)
         self.event = kwargs['event']
-        self.joined_alarm_name = kwargs.get('joined_alarm_name')
-        self.left_alarm_name = kwargs.get('left_alarm_name')
+        self.joined_alarm_name = config.joined_alarm_name
+        self.left_alarm_name = config.left_alarm_name
         self.na = NotificationAnalysis()
-        self.table = CounterTable(kwargs.get('table_name'), kwargs.get('primary_key_column_name'))
+        self.table = CounterTable(config.table_name, config.primary_key_column_name)
 
     def count(self):
-        message = json.loads(self.event['Records'][0]['Sns']['Message'])
+        message = json_loads(self.event['Records'][0]['Sns']['Message'])
         metric = int(self.na.extract_datapoint(message['NewStateReason']))
 
         if message['AlarmName'] == self.joined_alarm_name:
             result_metric = self.table.update_item(metric)
-            logger.info(json.dumps({
+            logger.info('%s', LazyJSONMessage({
                 'connected_count': result_metric,
                 'joined_count': metric,
                 'left_count': 0,
@@ -154,7 +229,7 @@ class CountCommandFromCloudWatchAlarmToDynamoDB(CountCommand):
             return result_metric
         elif message['AlarmName'] == self.left_alarm_name:
             result_metric = self.table.update_item(-metric)
-            logger.info(json.dumps({
+            logger.info('%s', LazyJSONMessage({
                 'connected_count': result_metric,
                 'joined_count': 0,
                 'left_count': metric,
@@ -173,11 +248,12 @@ class CountCommandFromCloudWatchAlarmToDynamoDB(CountCommand):
 
 class CountCommandFromCloudWatchAlarmToCloudWatchLogs(CountCommand):
     def __init__(self, **kwargs):
+        config = CountConfig.from_kwargs(kwargs)
         self.event = kwargs['event']
-        self.joined_alarm_name = kwargs.get('joined_alarm_name')
-        self.left_alarm_name = kwargs.get('left_alarm_name')
-        self.metric_namespace = kwargs.get('metric_namespace')
-        self.metric_name = kwargs.get('metric_name')
+        self.joined_alarm_name = config.joined_alarm_name
+        self.left_alarm_name = config.left_alarm_name
+        self.metric_namespace = config.metric_namespace
+        self.metric_name = config.metric_name
         self.na = NotificationAnalysis()
 
     def get_metric_data(self):  # pragma: no cover
@@ -206,28 +282,38 @@ class CountCommandFromCloudWatchAlarmToCloudWatchLogs(CountCommand):
         )
 
     def get_previous_metric(self):
-        needed_metrics = cw.list_metrics(Namespace=self.metric_namespace, MetricName=self.metric_name)['Metrics']
-        if needed_metrics:
-            metric_data = self.get_metric_data()
-            return metric_data['MetricDataResults'][0]['Values'][-1]
+        cached = previous_metric_cache.get((self.metric_namespace, self.metric_name))
+        if cached and time.monotonic() - cached[0] < PREVIOUS_METRIC_CACHE_SECONDS:
+            return cached[1]
+
+        # ListMetrics でメトリクスの存在を確認せず、GetMetricData の結果が空であれば未作成とみなす
+        values = self.get_metric_data()['MetricDataResults'][0]['Values']
+        if values:
+            previous_metric = values[-1]
         else:
-            logger.info(f'{self.metric_namespace}/{self.metric_name} metric is not found.')
-            return 0.0
+            logger.info('%s/%s metric is not found.', self.metric_namespace, self.metric_name)
+            previous_metric = 0.0
+
+        self._cache_previous_metric(previous_metric)
+        return previous_metric
+
+    def _cache_previous_metric(self, metric):
+        previous_metric_cache[(self.metric_namespace, self.metric_name)] = (time.monotonic(), metric)
 
     def count(self):
-        message = json.loads(self.event['Records'][0]['Sns']['Message'])
+        message = json_loads(self.event['Records'][0]['Sns']['Message'])
         previous_metric = int(self.get_previous_metric())
         metric = int(self.na.extract_datapoint(message['NewStateReason']))
 
         if message['AlarmName'] == self.joined_alarm_name:
-            return {
+            result = {
                 'previous_count': previous_metric,
                 'connected_count': previous_metric + metric,
                 'joined_count': metric,
                 'left_count': 0,
             }
         elif message['AlarmName'] == self.left_alarm_name:
-            return {
+            result = {
                 'previous_count': previous_metric,
                 'connected_count': previous_metric - metric,
                 'joined_count': 0,
@@ -236,6 +322,10 @@ class CountCommandFromCloudWatchAlarmToCloudWatchLogs(CountCommand):
         else:
             raise AlarmNotFoundError()
 
+        # キャッシュ有効期間内の次回呼出しでは、メトリクスへ反映される前の今回の結果を直前の値とする
+        self._cache_previous_metric(result['connected_count'])
+        return result
+
     def check_event_source(self):
         try:
             return self.event['Records'][0]['Sns']['Message']
@@ -244,19 +334,22 @@ class CountCommandFromCloudWatchAlarmToCloudWatchLogs(CountCommand):
 
 
 class CounterTable:
+    # リクエストごとに変化しない更新式は、呼出しのたびに生成しない
+    UPDATE_EXPRESSION = 'ADD #count :count'
+    EXPRESSION_ATTRIBUTE_NAMES = {'#count': 'count'}
+
     def __init__(self, table_name, primary_key_column_name):
         self.table_name = table_name
         self.primary_key_column_name = primary_key_column_name
+        self.key = {primary_key_column_name: {'S': 'counter'}}
 
     def update_item(self, count):
         result = dynamodb.update_item(
             TableName=self.table_name,
             ReturnValues='UPDATED_NEW',
-            Key={self.primary_key_column_name: {'S': 'counter'}},
-            UpdateExpression=f'ADD #count :count',
-            ExpressionAttributeNames={
-                f'#count': 'count',
-            },
+            Key=self.key,
+            UpdateExpression=self.UPDATE_EXPRESSION,
+            ExpressionAttributeNames=self.EXPRESSION_ATTRIBUTE_NAMES,
             ExpressionAttributeValues={
                 ':count': {
                     'N': str(count),
@@ -280,9 +373,49 @@ class NotificationAnalysis:
         数値が下がる場合の理由文は以下のようになる。
         なお、現状では数値が下がる際の通知は届かない設定になっている。
         E.g.) 'Threshold Crossed: 1 out of the last 1 datapoints [0.0 (01/08/22 15:06:00)] was not greater than or equal to the threshold (1.0) (minimum 1 datapoint for ALARM -> OK transition).'
+
+        Raises
+        ------
+        ValueError
+            理由文に小数形式のデータポイントが含まれない場合 (nan や inf 、指数表記を含む) 。
         """
         logger.info(notification_log_from_sns)
-        return float(re.findall(r'\[([0-9.-]*)\s*\([^)]*\)\]', notification_log_from_sns)[0])
+
+        # 理由文の形式は固定のため、まずは全文を検索せずに最初の `[...]` 部分のみを正規表現と照合する
+        # float() に直接渡すと nan や inf なども受け付けてしまうため、数値の形式は正規表現で確認する
+        start = notification_log_from_sns.find('[')
+        end = notification_log_from_sns.find(']', start)
+        if start != -1 and end != -1:
+            match = DATAPOINT_PATTERN.fullmatch(notification_log_from_sns, start, end + 1)
+            if match:
+                return float(match.group(1))
+
+        # 最初の `[...]` がデータポイントでない場合に備え、全文から検索する
+        match = DATAPOINT_PATTERN.search(notification_log_from_sns)
+        if match is None:
+            raise ValueError(f'datapoint is not found in {notification_log_from_sns!r}')
+
+        return float(match.group(1))
+
+
+class LazyJSONMessage:
+    """
+    ログ出力時にのみJSON文字列へ変換するメッセージ.
+
+    Notes
+    -----
+    ログレベルによって出力されない場合は変換処理自体を実行しない。
+
+    Examples
+    --------
+    >>> logger.info('%s', LazyJSONMessage({'connected_count': 1}))
+
+    """
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return json_dumps(self.obj)
 
 
 class LogState(Enum):
@@ -291,6 +424,13 @@ class LogState(Enum):
     INITIAL_ACTIVATION_OF_KINESIS_DATA_STREAM = auto()
 
 
+# 接続ユーザー数の増減に関わるログの状態と、その増減値
+LOG_STATE_DELTAS = {
+    LogState.JOINED: 1,
+    LogState.LEFT: -1,
+}
+
+
 class AlarmNotFoundError(RuntimeError):
     pass
 
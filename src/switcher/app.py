@@ -11,11 +11,12 @@ logger.setLevel(INFO)
 
 app = FastAPI()
 app.include_router(router)
+mangum_handler = Mangum(app)
 
 
 def handler(event, context):
     if 'Records' in event:
-        logger.info(f'{event=}')
+        logger.info('event=%r', event)
         event = {
             'httpMethod': 'GET',
             'resource': '/',
@@ -25,4 +26,4 @@ def handler(event, context):
             'requestContext': {},
         }
 
-    return Mangum(app)(event, context)
+    return mangum_handler(event, context)
@@ -1,14 +1,26 @@
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger, INFO
 
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 
 logger = getLogger(__name__)
 logger.setLevel(INFO)
 
-cfn = boto3.client('cloudformation')
-dynamodb = boto3.client('dynamodb')
+# 既定の60秒タイムアウトではFunction URLの応答が長く詰まるため、短いタイムアウトと適応型リトライを設定する
+boto3_config = Config(
+    connect_timeout=2,
+    read_timeout=5,
+    retries={'max_attempts': 3, 'mode': 'adaptive'},
+    max_pool_connections=50,
+)
+
+cfn = boto3.client('cloudformation', config=boto3_config)
+dynamodb = boto3.client('dynamodb', config=boto3_config)
+
+executor = ThreadPoolExecutor(max_workers=2)
 
 
 class MinecraftSwitcher:
@@ -32,14 +44,22 @@ class MinecraftSwitcher:
     >>> switcher = MinecraftSwitcher(stack_name, table_name, primary_key_column_name)
     >>> switcher.update_cloudformation_stack(overrode_parameters, capabilities)
 
+    >>> # Clients are shared module-level ones unless injected
+    >>> switcher = MinecraftSwitcher(stack_name, table_name, primary_key_column_name, cfn_client=boto3.client('cloudformation'))
+
     """
-    def __init__(self, stack_name, table_name, primary_key_column_name):
-        if not(type(stack_name) is str and len(stack_name)):
-            raise
+    def __init__(self, stack_name, table_name, primary_key_column_name, cfn_client=None, dynamodb_client=None):
+        if not isinstance(stack_name, str) or not stack_name:
+            raise ValueError('stack_name must be a non-empty str')
+        if table_name is not None and (not isinstance(primary_key_column_name, str) or not primary_key_column_name):
+            raise ValueError('primary_key_column_name must be a non-empty str when table_name is set')
 
         self._stack_name = stack_name
         self._table_name = table_name
         self._primary_key_column_name = primary_key_column_name
+        self._counter_key = {primary_key_column_name: {'S': 'counter'}}
+        self._cfn = cfn_client or cfn
+        self._dynamodb = dynamodb_client or dynamodb
 
     def get_cloudformation_parameters(self):
         """
@@ -48,6 +68,7 @@ class MinecraftSwitcher:
         Notes
         -----
         self.update_cloudformation_stask メソッド内部で利用しているため、こちらのメソッドの実行は基本的には必要ない。
+        他のLambda実行環境やコンソールからの変更、ロールバックを反映するため、取得結果はキャッシュせず毎回DescribeStacksする。
 
         Returns
         -------
@@ -56,9 +77,9 @@ class MinecraftSwitcher:
 
         """
         try:
-            stacks = cfn.describe_stacks(StackName=self._stack_name)['Stacks']
+            stacks = self._cfn.describe_stacks(StackName=self._stack_name)['Stacks']
         except ClientError:
-            logger.warning(f'Stack is not found (stack_name={self._stack_name})')
+            logger.warning('Stack is not found (stack_name=%s)', self._stack_name)
             return None
 
         # 同名スタックは共存しないため、スタックが見つかった場合は1つのみを取得する (空文字で検索した場合を除く)
@@ -89,46 +110,57 @@ class MinecraftSwitcher:
             アップデート実行時、まだユーザーが接続している場合に投げる。
 
         """
-        if self._is_connected_any_users(self._table_name, self._primary_key_column_name):
-            raise UserStillConnectedError()
+        # 接続ユーザー数の確認 (DynamoDB) とパラメーター取得 (CloudFormation) は独立しているため並行に実行する
+        # テーブル未指定時は接続ユーザー数を確認しない
+        connected = executor.submit(self._is_connected_any_users) if self._table_name is not None else None
 
-        params = self.get_cloudformation_parameters()
+        try:
+            params = self.get_cloudformation_parameters()
+        except Exception:
+            # DescribeStacksが失敗した場合も、接続ユーザー数の確認 (例外を含む) の完了を待ち、結果を回収してから投げ直す
+            if connected is not None:
+                connected.exception()
+            raise
+
+        if connected is not None and connected.result():
+            raise UserStillConnectedError()
 
         if params is None:
             raise NotFoundStackError()
 
-        params = [self._override_param_if_need(p, overrode_parameters) for p in params]
+        # 上書きパラメーターの生成と更新要否の判定を1回の走査で済ませる
+        is_changed = False
+        overrode_params = []
+        for p in params:
+            overrode, changed = self._override_param_if_need(p, overrode_parameters)
+            is_changed |= changed
+            overrode_params.append(overrode)
 
-        if not all((p.get('UsePreviousValue') for p in params)):
-            cfn.update_stack(
+        if is_changed:
+            self._cfn.update_stack(
                 StackName=self._stack_name,
-                Parameters=params,
+                Parameters=overrode_params,
                 UsePreviousTemplate=True,
                 Capabilities=capabilities
             )
         else:
-            logger.warning(f'Stack is unnecessary to update (stack_name={self._stack_name})')
+            logger.warning('Stack is unnecessary to update (stack_name=%s)', self._stack_name)
             raise UnnecessaryToUpdateStackError()
 
     def _override_param_if_need(self, param, overrode_parameters):
-        overrode = param.copy()
         key = param['ParameterKey']
 
-        if key in overrode_parameters.keys() and overrode['ParameterValue'] != overrode_parameters[key]:
-            overrode['ParameterValue'] = overrode_parameters[key]
-        else:
-            del overrode['ParameterValue']
-            overrode |= {'UsePreviousValue': True}
-
-        return overrode
+        if key in overrode_parameters and param['ParameterValue'] != overrode_parameters[key]:
+            return {'ParameterKey': key, 'ParameterValue': overrode_parameters[key]}, True
 
-    def _is_connected_any_users(self, table_name, primary_key_column_name):
-        if table_name is None:
-            return False
+        return {'ParameterKey': key, 'UsePreviousValue': True}, False
 
-        result = dynamodb.get_item(
+    def _is_connected_any_users(self):
+        result = self._dynamodb.get_item(
             TableName=self._table_name,
-            Key={primary_key_column_name: {'S': 'counter'}}
+            Key=self._counter_key,
+            ProjectionExpression='#c',
+            ExpressionAttributeNames={'#c': 'count'}
         )
 
         return int(result.get('Item', {}).get('count', {}).get('N', '0')) > 0
@@ -1,8 +1,9 @@
+from functools import lru_cache
 from logging import getLogger, INFO
 import os
 
 from botocore.exceptions import ClientError
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 
 from lib.minecraft_switcher import (
     MinecraftSwitcher,
@@ -21,36 +22,58 @@ changed_task_count_parameter = os.getenv('CHANGED_TASK_COUNT_PARAMETER')
 table_name = os.getenv('TABLE_NAME')
 primary_key_column_name = os.getenv('PRIMARY_KEY_COLUMN_NAME', 'id')
 
+# 起動／停止時の上書きパラメーターは固定値のため、リクエスト毎に生成しない
+ON_PARAMETERS = {switched_parameter: 'true', changed_task_count_parameter: '1'}
+OFF_PARAMETERS = {switched_parameter: 'false', changed_task_count_parameter: '0'}
+
 router = APIRouter()
 
 
-@router.get('/health')
-def health():
-    return {'message': 'OK'}
+@lru_cache
+def get_switcher():
+    """Lambda実行環境内で1つの MinecraftSwitcher (およびAWSクライアント) をリクエスト間で使い回す."""
+    return MinecraftSwitcher(stack_name, table_name, primary_key_column_name)
+
+
+class HealthEndpoint:
+    """
+    ヘルスチェック用のASGIアプリ.
+
+    Notes
+    -----
+    FastAPIの依存性解決やレスポンスのシリアライズを経由せず、事前に生成した固定のレスポンスを直接返す。
+    GETのルートにはStarletteがHEADも自動で追加するため、HEADの場合はヘッダーのみを返す。
+    """
+    body = b'{"message":"OK"}'
+    headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode()),
+    ]
+
+    async def __call__(self, scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 200, 'headers': self.headers})
+        await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else self.body})
+
+
+router.add_route('/health', HealthEndpoint(), methods=['GET'], include_in_schema=False)
 
 
 @router.get('/switch/on')
-def switch_on():
-    return _switch('on', 1)
+def switch_on(switcher: MinecraftSwitcher = Depends(get_switcher)):
+    return _switch(switcher, 'on', ON_PARAMETERS)
 
 
 @router.get('/switch/off')
-def switch_off():
-    return _switch('off', 0)
-
+def switch_off(switcher: MinecraftSwitcher = Depends(get_switcher)):
+    return _switch(switcher, 'off', OFF_PARAMETERS)
 
-def _switch(on_off, task_count):
-    is_on = on_off == 'on'
-    switcher = MinecraftSwitcher(stack_name, table_name, primary_key_column_name)
 
+def _switch(switcher, on_off, overrode_parameters):
     try:
-        switcher.update_cloudformation_stack({
-            switched_parameter: 'true' if is_on else 'false',
-            changed_task_count_parameter: str(task_count),
-        }, ['CAPABILITY_NAMED_IAM'])
+        switcher.update_cloudformation_stack(overrode_parameters, ['CAPABILITY_NAMED_IAM'])
         return {'message': f'Try to switch {on_off}, so please wait.'}
     except ClientError:
-        logger.exception(f'Failed to update stack for switch {on_off}.')
+        logger.exception('Failed to update stack for switch %s.', on_off)
         return {'message': f'Failed to update stack for switch {on_off} ({stack_name=}).'}
     except UnnecessaryToUpdateStackError:
         return {'message': f'Stack is unnecessary to switch {on_off} ({stack_name=}).'}
@@ -1,11 +1,20 @@
 import base64
 import boto3
-from datetime import datetime, timedelta
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 import gzip
 import json
+import logging
+import math
+from string import Template
+from unittest.mock import patch
 
+import orjson
 import pytest
 from moto import mock_cloudwatch, mock_dynamodb
+from moto.cloudwatch.models import cloudwatch_backends
+from moto.core import ACCOUNT_ID
 
 with mock_cloudwatch(), mock_dynamodb():
     from lib.clients_counter import (
@@ -14,43 +23,42 @@ with mock_cloudwatch(), mock_dynamodb():
         CountCommandFromCloudWatchLogsToDynamoDB,
         CountCommandFromCloudWatchAlarmToDynamoDB,
         CountCommandFromCloudWatchAlarmToCloudWatchLogs,
+        CountConfig,
         CounterTable,
         NotificationAnalysis,
+        LazyJSONMessage,
         LogState,
         UnknownEventSource,
         UnknownLogState,
+        previous_metric_cache,
     )
 
+    # メトリクスの取得や、 moto のバックエンドのリージョンの参照に使い回すため、モジュール読込時に1度だけ生成する
+    cloudwatch = boto3.client('cloudwatch')
+
+
+# 各テストで共通して利用する時刻は、モジュール読込時に1度だけ生成する
+_T_14 = datetime(2022, 8, 1, 14)
+_T_14_31 = datetime(2022, 8, 1, 14, 31)
+_T_15 = datetime(2022, 8, 1, 15)
+_T_15_20 = datetime(2022, 8, 1, 15, 20)
+_T_15_25 = datetime(2022, 8, 1, 15, 25)
+_T_15_26 = datetime(2022, 8, 1, 15, 26)
+_T_15_30 = datetime(2022, 8, 1, 15, 30)
+_T_15_31 = datetime(2022, 8, 1, 15, 31)
+_T_15_59 = datetime(2022, 8, 1, 15, 59)
+_T_16 = datetime(2022, 8, 1, 16)
+
+
+@pytest.fixture(autouse=True)
+def clear_previous_metric_cache():
+    previous_metric_cache.clear()
+
 
 def _create_cloudwatch_log_event(timestamp, data_states, user_name, is_first=False):
-    if is_first:
-        data = [{
-            'messageType': 'CONTROL_MESSAGE',
-            'owner': 'CloudwatchLogs',
-            'logGroup': '',
-            'logStream': '',
-            'subscriptionFilters': [],
-            'logEvents': [{
-                'id': '',
-                'timestamp': round(timestamp.timestamp(), 3) * 1000,
-                'message': 'CWL CONTROL MESSAGE: Checking health of destination Kinesis stream.'
-            }],
-        }]
-    else:
-        data = [{
-            'messageType': 'DATA_MESSAGE',
-            'owner': '000000000000',
-            'logGroup': '/ecs/logs/minecraft-environment-deployment/minecraft-server',
-            'logStream': 'minecraft/minecraft-server/xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx',
-            'subscriptionFilters': [
-                'minecraft-environment-deployment-MinecraftECSConnectedCountSubscriptionFilter-xxxxxxxxxxxx',
-            ],
-            'logEvents': [{
-                'id': '33333333333333333333333333333333333333333333333333333333',
-                'timestamp': round(timestamp.timestamp(), 3) * 1000,
-                'message': f'[{timestamp.strftime("%H:%M:%S")}] [Server thread/INFO]: {user_name} {log_event_state} the game',
-            } for log_event_state in data_state],
-        } for data_state in data_states]
+    # lru_cache のキーにするため、リストのリストをタプルのタプルに変換する
+    states = tuple(tuple(s) for s in data_states) if data_states is not None else None
+    arrival_timestamp = round(timestamp.timestamp(), 3)
 
     return {
         'Records': [{
@@ -58,8 +66,8 @@ def _create_cloudwatch_log_event(timestamp, data_states, user_name, is_first=Fal
                 'kinesisSchemaVersion': '1.0',
                 'partitionKey': '3e21f5e8240cbb048271af4fdb892a1c',
                 'sequenceNumber': '49634156167133626984422846403173197967042654711234691106',
-                'data': base64.b64encode(gzip.compress(json.dumps(d).encode())).decode(),
-                'approximateArrivalTimestamp': round(timestamp.timestamp(), 3),
+                'data': data,
+                'approximateArrivalTimestamp': arrival_timestamp,
             },
             'eventSource': 'aws:kinesis',
             'eventVersion': '1.0',
@@ -68,139 +76,174 @@ def _create_cloudwatch_log_event(timestamp, data_states, user_name, is_first=Fal
             'invokeIdentityArn': 'arn:aws:iam::485332844223:role/minecraft-environment-dep-MinecraftECSConnectedSom-11P9E4LPBFG0O',
             'awsRegion': 'ap-northeast-1',
             'eventSourceARN': 'arn:aws:kinesis:ap-northeast-1:485332844223:stream/minecraft-environment-deployment-MinecraftECSLogKinesisDataStream-Ckgt1t0sQ1pd',
-        } for d in data],
+        } for data in _encode_cloudwatch_log_data(timestamp, states, user_name, is_first)],
     }
 
 
+# Kinesis Data Streams に送られるログデータのうち、ログイベント以外の固定部分
+_DATA_MESSAGE_BASE = {
+    'messageType': 'DATA_MESSAGE',
+    'owner': '000000000000',
+    'logGroup': '/ecs/logs/minecraft-environment-deployment/minecraft-server',
+    'logStream': 'minecraft/minecraft-server/xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx',
+    'subscriptionFilters': [
+        'minecraft-environment-deployment-MinecraftECSConnectedCountSubscriptionFilter-xxxxxxxxxxxx',
+    ],
+}
+
+
+@lru_cache(maxsize=256)
+def _encode_cloudwatch_log_data(timestamp, data_states, user_name, is_first):
+    """同じ引数で生成するログデータは、gzip圧縮・base64エンコード済みの結果を使い回す."""
+    # 全ログイベントで共通のため、タイムスタンプの変換は1度だけ行う
+    timestamp_ms = round(timestamp.timestamp(), 3) * 1000
+    time_text = timestamp.strftime("%H:%M:%S")
+
+    if is_first:
+        data = [{
+            'messageType': 'CONTROL_MESSAGE',
+            'owner': 'CloudwatchLogs',
+            'logGroup': '',
+            'logStream': '',
+            'subscriptionFilters': [],
+            'logEvents': [{
+                'id': '',
+                'timestamp': timestamp_ms,
+                'message': 'CWL CONTROL MESSAGE: Checking health of destination Kinesis stream.'
+            }],
+        }]
+    else:
+        data = [{
+            **_DATA_MESSAGE_BASE,
+            'logEvents': [{
+                'id': '33333333333333333333333333333333333333333333333333333333',
+                'timestamp': timestamp_ms,
+                'message': f'[{time_text}] [Server thread/INFO]: {user_name} {state} the game',
+            } for state in states],
+        } for states in data_states]
+
+    # デコード側は圧縮率に依存しないため、最速の圧縮レベルで生成する
+    return tuple(base64.b64encode(gzip.compress(orjson.dumps(d), compresslevel=1)).decode() for d in data)
+
+
+# 通知メッセージは可変部分以外が固定のため、JSON文字列のテンプレートをモジュール読込時に1度だけ生成する
+_CLOUDWATCH_ALARM_MESSAGE_TEMPLATE = Template(orjson.dumps({
+    'AlarmName': '${alarm_name}',
+    'AlarmDescription': None,
+    'AWSAccountId': 'xxxxxxxxxxxx',
+    'AlarmConfigurationUpdatedTimestamp': '2022-01-01T00:00:00.000+0000',
+    'NewStateValue': 'ALARM',
+    'NewStateReason': 'Threshold Crossed: 1 out of the last 1 datapoints [${value} (${reason_timestamp})] was greater than or equal to the threshold (1.0) (minimum 1 datapoint for OK -> ALARM transition).',
+    'StateChangeTime': '${state_change_time}',
+    'Region': 'Asia Pacific (Tokyo)',
+    'AlarmArn': 'arn:aws:cloudwatch:ap-northeast-1:xxxxxxxxxxxx:alarm:${alarm_name}',
+    'OldStateValue': 'OK',
+    'OKActions': [],
+    'AlarmActions': [
+        'arn:aws:sns:ap-northeast-1:xxxxxxxxxxxx:SampleSNSTopic',
+    ],
+    'InsufficientDataActions': [],
+    'Trigger': {
+        'MetricName': '${metric_name}',
+        'Namespace': '${namespace}',
+        'StatisticType': 'Statistic',
+        'Statistic': 'Sum',
+        'Unit': None,
+        'Dimensions': [],
+        'Period': 60,
+        'EvaluationPeriods': 1,
+        'ComparisonOperator': 'MoreThanOrEqualToThreshold',
+        'Threshold': 1,
+        'TreatMissingData': '',
+        'EvaluateLowSampleCountPercentile': '',
+    },
+}).decode())
+
+
+def _escape_json_string(value):
+    return orjson.dumps(str(value)).decode()[1:-1]
+
+
 def _create_cloudwatch_alarm_event(alarm_name, timestamp, value, namespace='test_namespace', metric_name='test_metric_name'):
     return {
         'Records': [{
             'Sns': {
-                'Message': json.dumps({
-                    'AlarmName': alarm_name,
-                    'AlarmDescription': None,
-                    'AWSAccountId': 'xxxxxxxxxxxx',
-                    'AlarmConfigurationUpdatedTimestamp': '2022-01-01T00:00:00.000+0000',
-                    'NewStateValue': 'ALARM',
-                    'NewStateReason': f'Threshold Crossed: 1 out of the last 1 datapoints [{value} ({timestamp.strftime("%d/%m/%y %H:%M:%S")})] was greater than or equal to the threshold (1.0) (minimum 1 datapoint for OK -> ALARM transition).',
-                    'StateChangeTime': timestamp.isoformat(),
-                    'Region': 'Asia Pacific (Tokyo)',
-                    'AlarmArn': f'arn:aws:cloudwatch:ap-northeast-1:xxxxxxxxxxxx:alarm:{alarm_name}',
-                    'OldStateValue': 'OK',
-                    'OKActions': [],
-                    'AlarmActions': [
-                        'arn:aws:sns:ap-northeast-1:xxxxxxxxxxxx:SampleSNSTopic',
-                    ],
-                    'InsufficientDataActions': [],
-                    'Trigger': {
-                        'MetricName': metric_name,
-                        'Namespace': namespace,
-                        'StatisticType': 'Statistic',
-                        'Statistic': 'Sum',
-                        'Unit': None,
-                        'Dimensions': [],
-                        'Period': 60,
-                        'EvaluationPeriods': 1,
-                        'ComparisonOperator': 'MoreThanOrEqualToThreshold',
-                        'Threshold': 1,
-                        'TreatMissingData': '',
-                        'EvaluateLowSampleCountPercentile': '',
-                    },
-                }),
+                'Message': _create_cloudwatch_alarm_message(alarm_name, timestamp, value, namespace, metric_name),
             },
         }],
     }
 
 
-def _create_table(table_name, primary_key):
-    with mock_dynamodb():
-        dynamodb = boto3.client('dynamodb')
-
-        dynamodb.create_table(
-            TableName=table_name,
-            AttributeDefinitions=[{'AttributeName': primary_key, 'AttributeType': 'S'}],
-            KeySchema=[{'AttributeName': primary_key, 'KeyType': 'HASH'}],
-            BillingMode='PAY_PER_REQUEST'
-        )
-
-
-@mock_cloudwatch
-@mock_dynamodb
-class TestClientsCounter:
-    def test_count_to_use_send_message_from_cloudwatch_logs_to_dynamodb(self, mocker):
-        m_check = mocker.spy(CountCommandFromCloudWatchLogsToDynamoDB, 'check_event_source')
-        m_count = mocker.spy(CountCommandFromCloudWatchLogsToDynamoDB, 'count')
-        _create_table('TestTable', 'id')
-        event = _create_cloudwatch_log_event(datetime(2022, 8, 1, 15, 31), [['joined']], 'user')
-        obj = ClientsCounter(event=event, table_name='TestTable', primary_key_column_name='id')
-        obj.command = CountCommandFromCloudWatchLogsToDynamoDB
-
-        obj.count()
-
-        m_check.assert_called_once()
-        m_count.assert_called_once()
-
-    def test_not_count_to_use_send_message_from_cloudwatch_logs_to_dynamodb_if_checking_is_failed(self, mocker):
-        m_check = mocker.patch('lib.clients_counter.CountCommandFromCloudWatchLogsToDynamoDB.check_event_source', return_value=False)
-        m_count = mocker.spy(CountCommandFromCloudWatchLogsToDynamoDB, 'count')
-        _create_table('TestTable', 'id')
-        event = _create_cloudwatch_log_event(datetime(2022, 8, 1, 15, 31), [['joined']], 'user')
-        obj = ClientsCounter(event=event, table_name='TestTable', primary_key_column_name='id')
-        obj.command = CountCommandFromCloudWatchLogsToDynamoDB
-
-        obj.count()
-
-        m_check.assert_called_once()
-        m_count.assert_not_called()
+@lru_cache(maxsize=64)
+def _create_cloudwatch_alarm_message(alarm_name, timestamp, value, namespace, metric_name):
+    """同じ引数で生成する通知メッセージは、生成済みのJSON文字列を使い回す."""
+    return _CLOUDWATCH_ALARM_MESSAGE_TEMPLATE.substitute(
+        alarm_name=_escape_json_string(alarm_name),
+        value=_escape_json_string(value),
+        reason_timestamp=timestamp.strftime("%d/%m/%y %H:%M:%S"),
+        state_change_time=timestamp.isoformat(),
+        metric_name=_escape_json_string(metric_name),
+        namespace=_escape_json_string(namespace),
+    )
 
-    def test_count_to_use_send_message_from_cloudwatch_alarm_to_dynamodb(self, mocker):
-        m_check = mocker.spy(CountCommandFromCloudWatchAlarmToDynamoDB, 'check_event_source')
-        m_count = mocker.spy(CountCommandFromCloudWatchAlarmToDynamoDB, 'count')
-        _create_table('TestTable', 'id')
-        event = _create_cloudwatch_alarm_event('joined_alarm', datetime(2022, 8, 1, 15, 31), 1.0)
-        obj = ClientsCounter(event=event, table_name='TestTable', primary_key_column_name='id', joined_alarm_name='joined_alarm', left_alarm_name='left_alarm')
-        obj.command = CountCommandFromCloudWatchAlarmToDynamoDB
 
-        obj.count()
+@contextmanager
+def count_calls(cls, name):
+    """
+    クラスのメソッドの呼出回数を数える.
 
-        m_check.assert_called_once()
-        m_count.assert_called_once()
+    Notes
+    -----
+    patch.object で差し替えるため、継承したメソッドの場合もサブクラスに属性を残さずに元の状態へ戻す。
+    autospec=True ではインスタンスが self として渡されるため、 wraps ではなく side_effect で元のメソッドを呼び出す。
+    """
+    with patch.object(cls, name, autospec=True, side_effect=getattr(cls, name)) as m:
+        yield m
 
-    def test_not_count_to_use_send_message_from_cloudwatch_alarm_to_dynamodb_if_checking_is_failed(self, mocker):
-        m_check = mocker.patch('lib.clients_counter.CountCommandFromCloudWatchAlarmToDynamoDB.check_event_source', return_value=False)
-        m_count = mocker.spy(CountCommandFromCloudWatchAlarmToDynamoDB, 'count')
-        _create_table('TestTable', 'id')
-        event = _create_cloudwatch_alarm_event('joined_alarm', datetime(2022, 8, 1, 15, 31), 1.0)
-        obj = ClientsCounter(event=event, table_name='TestTable', primary_key_column_name='id', joined_alarm_name='joined_alarm', left_alarm_name='left_alarm')
-        obj.command = CountCommandFromCloudWatchAlarmToDynamoDB
 
-        obj.count()
+parametrize_count_commands = pytest.mark.parametrize('command_class, event, kwargs', [
+    (
+        CountCommandFromCloudWatchLogsToDynamoDB,
+        _create_cloudwatch_log_event(_T_15_31, [['joined']], 'user'),
+        {'table_name': 'TestTable', 'primary_key_column_name': 'id'},
+    ),
+    (
+        CountCommandFromCloudWatchAlarmToDynamoDB,
+        _create_cloudwatch_alarm_event('joined_alarm', _T_15_31, 1.0),
+        {'table_name': 'TestTable', 'primary_key_column_name': 'id', 'joined_alarm_name': 'joined_alarm', 'left_alarm_name': 'left_alarm'},
+    ),
+    (
+        CountCommandFromCloudWatchAlarmToCloudWatchLogs,
+        _create_cloudwatch_alarm_event('joined_alarm', _T_15_31, 1.0),
+        {'joined_alarm_name': 'joined_alarm', 'left_alarm_name': 'left_alarm', 'metric_namespace': 'test_namespace', 'metric_name': 'test_metric_name'},
+    ),
+], ids=['cloudwatch_logs_to_dynamodb', 'cloudwatch_alarm_to_dynamodb', 'cloudwatch_alarm_to_cloudwatch_logs'])
 
-        m_check.assert_called_once()
-        m_count.assert_not_called()
 
-    def test_count_to_use_send_message_from_cloudwatch_alarm_to_cloudwatch_logs(self, mocker):
-        m_check = mocker.spy(CountCommandFromCloudWatchAlarmToCloudWatchLogs, 'check_event_source')
-        m_count = mocker.spy(CountCommandFromCloudWatchAlarmToCloudWatchLogs, 'count')
-        event = _create_cloudwatch_alarm_event('joined_alarm', datetime(2022, 8, 1, 15, 31), 1.0)
-        obj = ClientsCounter(event=event, joined_alarm_name='joined_alarm', left_alarm_name='left_alarm', metric_namespace='test_namespace', metric_name='test_metric_name')
-        obj.command = CountCommandFromCloudWatchAlarmToCloudWatchLogs
+@mock_cloudwatch
+@pytest.mark.usefixtures('shared_table')
+class TestClientsCounter:
+    @parametrize_count_commands
+    def test_count_to_use_send_message(self, mocker, counter_table, command_class, event, kwargs):
+        mocker.patch.object(CountCommandFromCloudWatchAlarmToCloudWatchLogs, 'get_metric_data', return_value={'MetricDataResults': [{'Values': []}]})
+        obj = ClientsCounter(command_class=command_class, event=event, **kwargs)
 
-        obj.count()
+        with count_calls(command_class, 'check_event_source') as m_check_event_source, count_calls(command_class, 'count') as m_count:
+            obj.count()
 
-        m_check.assert_called_once()
-        m_count.assert_called_once()
+        assert m_check_event_source.call_count == 1
+        assert m_count.call_count == 1
 
-    def test_not_count_to_use_send_message_from_cloudwatch_alarm_to_cloudwatch_logs_if_checking_is_failed(self, mocker):
-        m_check = mocker.patch('lib.clients_counter.CountCommandFromCloudWatchAlarmToCloudWatchLogs.check_event_source', return_value=False)
-        m_count = mocker.spy(CountCommandFromCloudWatchAlarmToCloudWatchLogs, 'count')
-        event = _create_cloudwatch_alarm_event('joined_alarm', datetime(2022, 8, 1, 15, 31), 1.0)
-        obj = ClientsCounter(event=event, joined_alarm_name='joined_alarm', left_alarm_name='left_alarm', metric_namespace='test_namespace', metric_name='test_metric_name')
-        obj.command = CountCommandFromCloudWatchAlarmToCloudWatchLogs
+    @parametrize_count_commands
+    def test_not_count_to_use_send_message_if_checking_is_failed(self, mocker, command_class, event, kwargs):
+        # 呼ばれないことのみを確認するため、元のメソッドを呼び出さないモックに差し替える
+        m_check_event_source = mocker.patch.object(command_class, 'check_event_source', return_value=False)
+        m_count = mocker.patch.object(command_class, 'count')
+        obj = ClientsCounter(command_class=command_class, event=event, **kwargs)
 
         obj.count()
 
-        m_check.assert_called_once()
+        m_check_event_source.assert_called_once()
         m_count.assert_not_called()
 
     def test_raise_error_if_command_is_set_count_command(self, mocker):
@@ -221,28 +264,67 @@ class TestCountCommand:
             obj.check_event_source()
 
 
-@mock_dynamodb
+class TestCountConfig:
+    def test_create_config_from_kwargs(self):
+        expected = CountConfig(table_name='TestTable', primary_key_column_name='id')
+
+        actual = CountConfig.from_kwargs({'event': {}, 'table_name': 'TestTable', 'primary_key_column_name': 'id'})
+
+        assert actual == expected
+
+    def test_use_config_in_kwargs(self):
+        expected = CountConfig(table_name='TestTable', primary_key_column_name='id')
+
+        actual = CountConfig.from_kwargs({'event': {}, 'config': expected, 'table_name': 'IgnoredTable'})
+
+        assert actual is expected
+
+    def test_set_config_to_command(self):
+        config = CountConfig(joined_alarm_name='joined_alarm', left_alarm_name='left_alarm', metric_namespace='test_namespace', metric_name='test_metric_name')
+
+        actual = CountCommandFromCloudWatchAlarmToCloudWatchLogs(event=None, config=config)
+
+        assert (actual.joined_alarm_name, actual.left_alarm_name, actual.metric_namespace, actual.metric_name) == ('joined_alarm', 'left_alarm', 'test_namespace', 'test_metric_name')
+
+
+@pytest.mark.usefixtures('shared_table')
 class TestCountCommandFromCloudWatchLogsToDynamoDB:
-    def test_count_if_user_is_joined(self):
-        _create_table('TestTable', 'id')
-        event = _create_cloudwatch_log_event(datetime(2022, 8, 1, 15, 31), [['joined']], 'user')
+    def test_count_if_user_is_joined(self, counter_table):
+        event = _create_cloudwatch_log_event(_T_15_31, [['joined']], 'user')
         obj = CountCommandFromCloudWatchLogsToDynamoDB(event=event, table_name='TestTable', primary_key_column_name='id')
 
         actual = obj.count()
 
         assert actual == [1]
 
-    def test_count_if_users_are_joined_and_left(self):
-        _create_table('TestTable', 'id')
-        event = _create_cloudwatch_log_event(datetime(2022, 8, 1, 15, 31), [['joined', 'joined', 'left'], ['left', 'joined'], ['joined'], ['left', 'left']], 'user')
+    def test_count_if_users_are_joined_and_left(self, counter_table):
+        event = _create_cloudwatch_log_event(_T_15_31, [['joined', 'joined', 'left'], ['left', 'joined'], ['joined'], ['left', 'left']], 'user')
         obj = CountCommandFromCloudWatchLogsToDynamoDB(event=event, table_name='TestTable', primary_key_column_name='id')
 
         actual = obj.count()
 
         assert actual == [1, 2, 1, 0, 1, 2, 1, 0]
 
+    def test_log_connected_count_as_json_if_user_is_joined(self, caplog, counter_table):
+        event = _create_cloudwatch_log_event(_T_15_31, [['joined']], 'user')
+        obj = CountCommandFromCloudWatchLogsToDynamoDB(event=event, table_name='TestTable', primary_key_column_name='id')
+
+        obj.count()
+
+        assert '{"connected_count":1,"joined_count":1,"left_count":0}' in caplog.messages
+
+    def test_update_table_only_once_if_users_are_joined_and_left(self, mocker, counter_table):
+        m_update_item = mocker.spy(CounterTable, 'update_item')
+        event = _create_cloudwatch_log_event(_T_15_31, [['joined', 'joined', 'left'], ['joined']], 'user')
+        obj = CountCommandFromCloudWatchLogsToDynamoDB(event=event, table_name='TestTable', primary_key_column_name='id')
+
+        actual = obj.count()
+
+        assert actual == [1, 2, 1, 2]
+        m_update_item.assert_called_once_with(obj.table, 2)
+
     def test_check_event_source_is_kinesis_data_stream(self):
-        event = _create_cloudwatch_log_event(datetime(2022, 8, 1, 15, 31), [['joined']], 'user')
+        event = _create_cloudwatch_log_event(_T_15_31, [['joined']], 'user')
         obj = CountCommandFromCloudWatchLogsToDynamoDB(event=event, table_name='TestTable', primary_key_column_name='id')
 
         actual = obj.check_event_source()
@@ -257,12 +339,10 @@ class TestCountCommandFromCloudWatchLogsToDynamoDB:
             obj.check_event_source()
 
     def test_decode_data_in_event_records(self):
-        expected = {
-            'Records': [
-                {'kinesis': {'data': {'logEvents': [{'id': '1'}]}}},
-                {'kinesis': {'data': {'logEvents': [{'id': '2'}]}}},
-            ],
-        }
+        expected = [
+            {'logEvents': [{'id': '1'}]},
+            {'logEvents': [{'id': '2'}]},
+        ]
         event = {
             'Records': [
                 {'kinesis': {'data': 'H4sIAPDvRmMC/6tWyslPdy1LzSspVrJSiK5WykwB0kqGSrWxtQC0KFpkHAAAAA=='}},
@@ -273,51 +353,69 @@ class TestCountCommandFromCloudWatchLogsToDynamoDB:
         }
         obj = CountCommandFromCloudWatchLogsToDynamoDB(event=event, table_name='TestTable', primary_key_column_name='id')
 
-        actual = obj.decode_event_records()
+        actual = [obj._decode_record_data(r) for r in event['Records']]
 
         assert actual == expected
 
-    def test_analyze_log_text_to_verify_that_user_is_joined(self):
-        event = _create_cloudwatch_log_event(datetime(2022, 8, 1, 15, 31), [['joined']], 'user')
+    def test_iter_log_states_to_verify_that_user_is_joined(self):
+        event = _create_cloudwatch_log_event(_T_15_31, [['joined']], 'user')
         obj = CountCommandFromCloudWatchLogsToDynamoDB(event=event, table_name='TestTable', primary_key_column_name='id')
 
-        actual = obj.analyze_log_text()
+        actual = obj.iter_log_states()
 
-        assert actual == [[LogState.JOINED]]
+        assert list(actual) == [LogState.JOINED]
 
-    def test_analyze_log_text_to_verify_that_user_is_left(self):
-        event = _create_cloudwatch_log_event(datetime(2022, 8, 1, 15, 31), [['left']], 'user')
+    def test_iter_log_states_to_verify_that_user_is_left(self):
+        event = _create_cloudwatch_log_event(_T_15_31, [['left']], 'user')
         obj = CountCommandFromCloudWatchLogsToDynamoDB(event=event, table_name='TestTable', primary_key_column_name='id')
 
-        actual = obj.analyze_log_text()
+        actual = obj.iter_log_states()
 
-        assert actual == [[LogState.LEFT]]
+        assert list(actual) == [LogState.LEFT]
+
+    def test_iter_log_states_to_verify_that_user_is_left_if_user_name_has_state_word(self):
+        event = _create_cloudwatch_log_event(_T_15_31, [['left']], 'joined_user')
+        obj = CountCommandFromCloudWatchLogsToDynamoDB(event=event, table_name='TestTable', primary_key_column_name='id')
+
+        actual = obj.iter_log_states()
+
+        assert list(actual) == [LogState.LEFT]
 
     def test_raise_error_if_log_text_is_unknown(self):
-        event = _create_cloudwatch_log_event(datetime(2022, 8, 1, 15, 31), [['unknown']], 'user')
+        event = _create_cloudwatch_log_event(_T_15_31, [['unknown']], 'user')
         obj = CountCommandFromCloudWatchLogsToDynamoDB(event=event, table_name='TestTable', primary_key_column_name='id')
 
         with pytest.raises(UnknownLogState):
-            obj.analyze_log_text()
+            list(obj.iter_log_states())
+
+    def test_iter_log_states_if_log_event_has_multi_log_events_and_multi_data(self):
+        event = _create_cloudwatch_log_event(_T_15_31, [['joined', 'joined', 'left'], ['left', 'joined'], ['joined'], ['left', 'left']], 'user')
+        obj = CountCommandFromCloudWatchLogsToDynamoDB(event=event, table_name='TestTable', primary_key_column_name='id')
+
+        actual = obj.iter_log_states()
 
-    def test_analyze_log_text_if_log_event_has_multi_log_events_and_multi_data(self):
-        event = _create_cloudwatch_log_event(datetime(2022, 8, 1, 15, 31), [['joined', 'joined', 'left'], ['left', 'joined'], ['joined'], ['left', 'left']], 'user')
+        assert list(actual) == [LogState.JOINED, LogState.JOINED, LogState.LEFT, LogState.LEFT, LogState.JOINED, LogState.JOINED, LogState.LEFT, LogState.LEFT]
+
+    def test_log_decoded_data_once_per_record(self, caplog):
+        event = _create_cloudwatch_log_event(_T_15_31, [['joined', 'joined'], ['left']], 'user')
         obj = CountCommandFromCloudWatchLogsToDynamoDB(event=event, table_name='TestTable', primary_key_column_name='id')
 
-        actual = obj.analyze_log_text()
+        with caplog.at_level(logging.INFO):
+            list(obj.iter_log_states())
 
-        assert actual == [[LogState.JOINED, LogState.JOINED, LogState.LEFT], [LogState.LEFT, LogState.JOINED], [LogState.JOINED], [LogState.LEFT, LogState.LEFT]]
+        actual = [json.loads(m) for m in caplog.messages if m.startswith('{')]
+        assert [len(data['logEvents']) for data in actual] == [2, 1]
 
-    def test_analyze_log_text_to_verify_that_kinesis_resource_is_created(self):
-        event = _create_cloudwatch_log_event(datetime(2022, 8, 1, 15, 31), None, None, is_first=True)
+    def test_iter_log_states_to_verify_that_kinesis_resource_is_created(self):
+        event = _create_cloudwatch_log_event(_T_15_31, None, None, is_first=True)
         obj = CountCommandFromCloudWatchLogsToDynamoDB(event=event, table_name='TestTable', primary_key_column_name='id')
 
-        actual = obj.analyze_log_text()
+        actual = obj.iter_log_states()
 
-        assert actual == [[LogState.INITIAL_ACTIVATION_OF_KINESIS_DATA_STREAM]]
+        assert list(actual) == [LogState.INITIAL_ACTIVATION_OF_KINESIS_DATA_STREAM]
 
     def test_result_is_empty_if_kinesis_resource_is_created(self):
-        event = _create_cloudwatch_log_event(datetime(2022, 8, 1, 15, 31), None, None, is_first=True)
+        event = _create_cloudwatch_log_event(_T_15_31, None, None, is_first=True)
         obj = CountCommandFromCloudWatchLogsToDynamoDB(event=event, table_name='TestTable', primary_key_column_name='id')
 
         actual = obj.count()
@@ -325,7 +423,7 @@ class TestCountCommandFromCloudWatchLogsToDynamoDB:
         assert actual == []
 
     def test_ckeck_that_event_source_is_kinesis_data_stream(self):
-        event = _create_cloudwatch_log_event(datetime(2022, 8, 1, 15, 31), None, None, is_first=True)
+        event = _create_cloudwatch_log_event(_T_15_31, None, None, is_first=True)
         obj = CountCommandFromCloudWatchLogsToDynamoDB(event=event)
 
         actual = obj.check_event_source()
@@ -345,20 +443,18 @@ class TestCountCommandFromCloudWatchLogsToDynamoDB:
             obj.check_event_source()
 
 
-@mock_dynamodb
+@pytest.mark.usefixtures('shared_table')
 class TestCountCommandFromCloudWatchAlarmToDynamoDB:
-    def test_count_if_user_is_joined(self):
-        _create_table('TestTable', 'id')
-        event = _create_cloudwatch_alarm_event('joined_alarm', datetime(2022, 8, 1, 15, 31), 1.0)
+    def test_count_if_user_is_joined(self, counter_table):
+        event = _create_cloudwatch_alarm_event('joined_alarm', _T_15_31, 1.0)
         obj = CountCommandFromCloudWatchAlarmToDynamoDB(event=event, table_name='TestTable', primary_key_column_name='id', joined_alarm_name='joined_alarm', left_alarm_name='left_alarm')
 
         actual = obj.count()
 
         assert actual == 1
 
-    def test_count_if_user_is_left_when_one_is_already_joined(self):
-        _create_table('TestTable', 'id')
-        event = _create_cloudwatch_alarm_event('joined_alarm', datetime(2022, 8, 1, 15, 31), 1.0)
+    def test_count_if_user_is_left_when_one_is_already_joined(self, counter_table):
+        event = _create_cloudwatch_alarm_event('joined_alarm', _T_15_31, 1.0)
         obj = CountCommandFromCloudWatchAlarmToDynamoDB(event=event, table_name='TestTable', primary_key_column_name='id', joined_alarm_name='joined_alarm', left_alarm_name='left_alarm')
         obj.count()
         event = _create_cloudwatch_alarm_event('left_alarm', datetime(2022, 8, 1, 15, 35), 1.0)
@@ -368,16 +464,15 @@ class TestCountCommandFromCloudWatchAlarmToDynamoDB:
 
         assert actual == 0
 
-    def test_not_count_if_cloudwatch_alarm_name_is_not_found(self, mocker):
-        _create_table('TestTable', 'id')
-        event = _create_cloudwatch_alarm_event('unknown_alarm', datetime(2022, 8, 1, 15, 31), 1.0)
+    def test_not_count_if_cloudwatch_alarm_name_is_not_found(self, mocker, counter_table):
+        event = _create_cloudwatch_alarm_event('unknown_alarm', _T_15_31, 1.0)
         obj = CountCommandFromCloudWatchAlarmToDynamoDB(event=event, table_name='TestTable', primary_key_column_name='id', joined_alarm_name='joined_alarm', left_alarm_name='left_alarm')
 
         with pytest.raises(RuntimeError):
             obj.count()
 
     def test_ckeck_that_event_source_is_sns_message(self):
-        event = _create_cloudwatch_alarm_event('joined_alarm', datetime(2022, 8, 1, 15, 31), 1.0)
+        event = _create_cloudwatch_alarm_event('joined_alarm', _T_15_31, 1.0)
         obj = CountCommandFromCloudWatchAlarmToDynamoDB(event=event)
 
         actual = obj.check_event_source()
@@ -399,67 +494,33 @@ class TestCountCommandFromCloudWatchAlarmToDynamoDB:
 
 @mock_cloudwatch
 class TestCountCommandFromCloudWatchAlarmToCloudWatchLogs:
-    cw = boto3.client('cloudwatch')
+    cw = cloudwatch
 
     def _set_to_repeat_fill_metric_data(self, namespace, metric_name, start_timestamp, end_timestamp, values):
-        """
-        指定時刻間における指定時刻の値以外の値を、1分単位で以前の値に設定する (初期値は0).
-
-        Examples
-        --------
-        >>> from datetime import datetime
-        >>> start_timestamp   = datetime(2022, 8, 1, 15)      # 2022-08-01T15:00:00:000
-        >>> start_1_timestamp = datetime(2022, 8, 1, 15, 5)   # 2022-08-01T15:05:00:000
-        >>> end_1_timestamp   = datetime(2022, 8, 1, 15, 10)  # 2022-08-01T15:10:00:000
-        >>> end_timestamp     = datetime(2022, 8, 1, 15, 15)  # 2022-08-01T15:15:00:000
-
-        >>> values = [
-        ...     {'timestamp': start_1_timestamp, 'value': 1},
-        ...     {'timestamp': end_1_timestamp,   'value': 0},
-        ... ]
-
-        >>> t = TestCountCommandFromCloudWatchAlarmToCloudWatchLogs()
-        >>> t._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', start_timestamp, end_timestamp, values)
-
-        >>> data = t._get_metric_data('test_namespace', 'test_metric_name', start_timestamp, end_timestamp)
-        >>> print([{'timestamp': str(t), 'value': v} for t, v in zip(data['MetricDataResults'][0]['Timestamps'], data['MetricDataResults'][0]['Values'])])
-        [
-            {'timestamp': '2022-08-01 15:00:00', 'value': 0.0},  # (start_timestamp)
-            {'timestamp': '2022-08-01 15:01:00', 'value': 0.0},
-            {'timestamp': '2022-08-01 15:02:00', 'value': 0.0},
-            {'timestamp': '2022-08-01 15:03:00', 'value': 0.0},
-            {'timestamp': '2022-08-01 15:04:00', 'value': 0.0},
-            {'timestamp': '2022-08-01 15:05:00', 'value': 1.0},  # (start_1_timestamp)
-            {'timestamp': '2022-08-01 15:06:00', 'value': 1.0},
-            {'timestamp': '2022-08-01 15:07:00', 'value': 1.0},
-            {'timestamp': '2022-08-01 15:08:00', 'value': 1.0},
-            {'timestamp': '2022-08-01 15:09:00', 'value': 1.0},
-            {'timestamp': '2022-08-01 15:10:00', 'value': 0.0},  # (end_1_timestamp)
-            {'timestamp': '2022-08-01 15:11:00', 'value': 0.0},
-            {'timestamp': '2022-08-01 15:12:00', 'value': 0.0},
-            {'timestamp': '2022-08-01 15:13:00', 'value': 0.0},
-            {'timestamp': '2022-08-01 15:14:00', 'value': 0.0},
-            # {'timestamp': '2022-08-01 15:15:00', 'value': 0.0},  # (end_timestamp, ignore data)
-        ]
-
-        """
-        current_timestamp = start_timestamp
+        """指定時刻間における指定時刻の値以外の値を、1分単位で以前の値に設定する (初期値は0)."""
+        # 値が変化する時刻を辞書で引けるようにし、1分単位の各時刻を直前の値で埋める (初期値は0)
+        changed_values = {v['timestamp']: v['value'] for v in values if start_timestamp <= v['timestamp'] < end_timestamp}
+        timestamps = [start_timestamp + timedelta(minutes=i) for i in range(math.ceil((end_timestamp - start_timestamp) / timedelta(minutes=1)))]
         current_value = 0
-        sorted_values = [s for s in sorted(values, key=lambda x: x['timestamp']) if start_timestamp <= s['timestamp'] < end_timestamp]
         metric_data = []
-
-        while current_timestamp < end_timestamp:
-            if sorted_values and current_timestamp == sorted_values[0]['timestamp']:
-                current_value = sorted_values[0]['value']
-                sorted_values.pop(0)
+        for t in timestamps:
+            current_value = changed_values.get(t, current_value)
             metric_data.append({
                 'MetricName': metric_name,
-                'Timestamp': current_timestamp,
+                'Timestamp': t,
                 'Value': current_value,
             })
-            current_timestamp += timedelta(minutes=1)
 
-        self.cw.put_metric_data(Namespace=namespace, MetricData=metric_data)
+        # PutMetricData の1回あたりの上限 (1000件) ごとに分割して書き込む
+        for i in range(0, len(metric_data), 1000):
+            self._put_metric_data(namespace, metric_data[i:i + 1000])
+
+    def _put_metric_data(self, namespace, metric_data):
+        # boto3 クライアントによるリクエストの生成・署名を経由せず、moto のバックエンドに直接書き込む
+        # boto3 はタイムゾーン無しの時刻をUTCとして送信するため、同じ扱いになるようにUTCを設定する
+        cloudwatch_backends[ACCOUNT_ID][self.cw.meta.region_name].put_metric_data(namespace, [
+            m | {'Timestamp': m['Timestamp'].replace(tzinfo=timezone.utc)} for m in metric_data
+        ])
 
     def _get_metric_data(self, namespace, metric_name, start_time, end_time):
         return self.cw.get_metric_data(
@@ -480,7 +541,7 @@ class TestCountCommandFromCloudWatchAlarmToCloudWatchLogs:
             EndTime=end_time
         )
 
-    def _mock_to_get_metric_data(self, mocker, namespace, metric_name, start_time, end_time):
+    def _mock_to_get_metric_data(self, monkeypatch, namespace, metric_name, start_time, end_time):
         """
         lib.clients_counter.CountCommandFromCloudWatchAlarmToCloudWatchLogs.get_metric_data メソッドをモック化する
 
@@ -494,11 +555,26 @@ class TestCountCommandFromCloudWatchAlarmToCloudWatchLogs:
 
         また、実行時間から相対的にデータを取得するため、その部分に対してもモック化が必要となる。
         """
-        mocker.patch('lib.clients_counter.CountCommandFromCloudWatchAlarmToCloudWatchLogs.get_metric_data', side_effect=lambda: self._get_metric_data(namespace, metric_name, start_time, end_time))
+        monkeypatch.setattr(CountCommandFromCloudWatchAlarmToCloudWatchLogs, 'get_metric_data', lambda _: self._get_metric_data(namespace, metric_name, start_time, end_time))
+
+    @pytest.mark.parametrize('values, expected', [
+        ([], [0.0] * 15),
+        ([{'timestamp': datetime(2022, 8, 1, 15, 5), 'value': 1}], [0.0] * 5 + [1.0] * 10),
+        ([{'timestamp': datetime(2022, 8, 1, 15, 5), 'value': 1}, {'timestamp': datetime(2022, 8, 1, 15, 10), 'value': 0}], [0.0] * 5 + [1.0] * 5 + [0.0] * 5),
+        ([{'timestamp': datetime(2022, 8, 1, 15, 15), 'value': 1}], [0.0] * 15),
+    ], ids=['no_values', 'count_up', 'count_up_and_down', 'ignore_end_timestamp'])
+    def test_repeat_fill_metric_data(self, values, expected):
+        end_timestamp = datetime(2022, 8, 1, 15, 15)
+        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', _T_15, end_timestamp, values)
+
+        data = self._get_metric_data('test_namespace', 'test_metric_name', _T_15, end_timestamp)['MetricDataResults'][0]
+        actual = [v for _, v in sorted(zip(data['Timestamps'], data['Values']))]
 
-    def test_get_all_zero_metric_data_without_one_timestamp(self, mocker):
-        self._mock_to_get_metric_data(mocker, 'test_namespace', 'test_metric_name', datetime(2022, 8, 1, 15), datetime(2022, 8, 1, 16))
-        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', datetime(2022, 8, 1, 15), datetime(2022, 8, 1, 16), [{'timestamp': datetime(2022, 8, 1, 15, 30), 'value': 1}, {'timestamp': datetime(2022, 8, 1, 15, 31), 'value': 0}])
+        assert actual == expected
+
+    def test_get_all_zero_metric_data_without_one_timestamp(self, monkeypatch):
+        self._mock_to_get_metric_data(monkeypatch, 'test_namespace', 'test_metric_name', _T_15, _T_16)
+        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', _T_15, _T_16, [{'timestamp': _T_15_30, 'value': 1}, {'timestamp': _T_15_31, 'value': 0}])
         obj = CountCommandFromCloudWatchAlarmToCloudWatchLogs(event=None, metric_namespace='test_namespace', metric_name='test_metric_name')
 
         actual = obj.get_metric_data()
@@ -509,10 +585,10 @@ class TestCountCommandFromCloudWatchAlarmToCloudWatchLogs:
         actual_values.pop(30)
         assert all(v == 0.0 for v in actual_values)
 
-    def test_get_previous_metric_when_metric_has_been_to_count_up(self, mocker):
-        self._mock_to_get_metric_data(mocker, 'test_namespace', 'test_metric_name', datetime(2022, 8, 1, 15), datetime(2022, 8, 1, 16))
-        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', datetime(2022, 8, 1, 15), datetime(2022, 8, 1, 16), [
-            {'timestamp': datetime(2022, 8, 1, 15, 30), 'value': 1},
+    def test_get_previous_metric_when_metric_has_been_to_count_up(self, monkeypatch):
+        self._mock_to_get_metric_data(monkeypatch, 'test_namespace', 'test_metric_name', _T_15, _T_16)
+        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', _T_15, _T_16, [
+            {'timestamp': _T_15_30, 'value': 1},
         ])
         obj = CountCommandFromCloudWatchAlarmToCloudWatchLogs(event=None, metric_namespace='test_namespace', metric_name='test_metric_name')
 
@@ -520,13 +596,13 @@ class TestCountCommandFromCloudWatchAlarmToCloudWatchLogs:
 
         assert actual == 1.0
 
-    def test_get_previous_metric_when_metric_has_been_to_count_up_more_than_one(self, mocker):
-        self._mock_to_get_metric_data(mocker, 'test_namespace', 'test_metric_name', datetime(2022, 8, 1, 15), datetime(2022, 8, 1, 16))
-        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', datetime(2022, 8, 1, 15), datetime(2022, 8, 1, 16), [
-            {'timestamp': datetime(2022, 8, 1, 15, 30), 'value': 1},
-            {'timestamp': datetime(2022, 8, 1, 15, 31), 'value': 2},
+    def test_get_previous_metric_when_metric_has_been_to_count_up_more_than_one(self, monkeypatch):
+        self._mock_to_get_metric_data(monkeypatch, 'test_namespace', 'test_metric_name', _T_15, _T_16)
+        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', _T_15, _T_16, [
+            {'timestamp': _T_15_30, 'value': 1},
+            {'timestamp': _T_15_31, 'value': 2},
             {'timestamp': datetime(2022, 8, 1, 15, 34), 'value': 1},
-            {'timestamp': datetime(2022, 8, 1, 15, 59), 'value': 3},
+            {'timestamp': _T_15_59, 'value': 3},
         ])
         obj = CountCommandFromCloudWatchAlarmToCloudWatchLogs(event=None, metric_namespace='test_namespace', metric_name='test_metric_name')
 
@@ -534,11 +610,11 @@ class TestCountCommandFromCloudWatchAlarmToCloudWatchLogs:
 
         assert actual == 3.0
 
-    def test_get_previous_metric_when_metric_has_been_to_count_down(self, mocker):
-        self._mock_to_get_metric_data(mocker, 'test_namespace', 'test_metric_name', datetime(2022, 8, 1, 15), datetime(2022, 8, 1, 16))
-        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', datetime(2022, 8, 1, 15), datetime(2022, 8, 1, 16), [
-            {'timestamp': datetime(2022, 8, 1, 15, 30), 'value': 1},
-            {'timestamp': datetime(2022, 8, 1, 15, 31), 'value': 0},
+    def test_get_previous_metric_when_metric_has_been_to_count_down(self, monkeypatch):
+        self._mock_to_get_metric_data(monkeypatch, 'test_namespace', 'test_metric_name', _T_15, _T_16)
+        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', _T_15, _T_16, [
+            {'timestamp': _T_15_30, 'value': 1},
+            {'timestamp': _T_15_31, 'value': 0},
         ])
         obj = CountCommandFromCloudWatchAlarmToCloudWatchLogs(event=None, metric_namespace='test_namespace', metric_name='test_metric_name')
 
@@ -546,10 +622,10 @@ class TestCountCommandFromCloudWatchAlarmToCloudWatchLogs:
 
         assert actual == 0.0
 
-    def test_get_previous_metric_when_metric_has_been_to_count_down_more_than_one(self, mocker):
-        self._mock_to_get_metric_data(mocker, 'test_namespace', 'test_metric_name', datetime(2022, 8, 1, 15), datetime(2022, 8, 1, 16))
-        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', datetime(2022, 8, 1, 15), datetime(2022, 8, 1, 16), [
-            {'timestamp': datetime(2022, 8, 1, 15, 30), 'value': 5},
+    def test_get_previous_metric_when_metric_has_been_to_count_down_more_than_one(self, monkeypatch):
+        self._mock_to_get_metric_data(monkeypatch, 'test_namespace', 'test_metric_name', _T_15, _T_16)
+        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', _T_15, _T_16, [
+            {'timestamp': _T_15_30, 'value': 5},
             {'timestamp': datetime(2022, 8, 1, 15, 39), 'value': 1},
             {'timestamp': datetime(2022, 8, 1, 15, 40), 'value': 4},
             {'timestamp': datetime(2022, 8, 1, 15, 41), 'value': 2},
@@ -560,109 +636,102 @@ class TestCountCommandFromCloudWatchAlarmToCloudWatchLogs:
 
         assert actual == 2.0
 
-    def test_get_previous_metric_when_metric_has_not_been_to_count_up_or_down(self, mocker):
-        self._mock_to_get_metric_data(mocker, 'test_namespace', 'test_metric_name', datetime(2022, 8, 1, 15), datetime(2022, 8, 1, 16))
-        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', datetime(2022, 8, 1, 15), datetime(2022, 8, 1, 16), [])
+    def test_get_previous_metric_when_metric_has_not_been_to_count_up_or_down(self, monkeypatch):
+        self._mock_to_get_metric_data(monkeypatch, 'test_namespace', 'test_metric_name', _T_15, _T_16)
+        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', _T_15, _T_16, [])
         obj = CountCommandFromCloudWatchAlarmToCloudWatchLogs(event=None, metric_namespace='test_namespace', metric_name='test_metric_name')
 
         actual = obj.get_previous_metric()
 
         assert actual == 0.0
 
-    def test_get_previous_metric_when_metric_is_not_created(self, mocker):
-        self._mock_to_get_metric_data(mocker, 'test_namespace', 'test_metric_name', datetime(2022, 8, 1, 15), datetime(2022, 8, 1, 16))
+    def test_get_previous_metric_when_metric_is_not_created(self, monkeypatch):
+        self._mock_to_get_metric_data(monkeypatch, 'test_namespace', 'test_metric_name', _T_15, _T_16)
         obj = CountCommandFromCloudWatchAlarmToCloudWatchLogs(event=None, metric_namespace='test_namespace', metric_name='test_metric_name')
 
         actual = obj.get_previous_metric()
 
         assert actual == 0.0
 
-    def test_count_for_cloudwatch_logs_metric_filter_if_function_is_called_by_joined_alarm_when_metric_has_not_been_to_count_up_or_down(self, mocker):
-        self._mock_to_get_metric_data(mocker, 'test_namespace', 'test_metric_name', datetime(2022, 8, 1, 14, 31), datetime(2022, 8, 1, 15, 31))
-        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', datetime(2022, 8, 1, 14), datetime(2022, 8, 1, 16), [])
-        event = _create_cloudwatch_alarm_event('joined_alarm', datetime(2022, 8, 1, 15, 31), 1.0)
-        obj = CountCommandFromCloudWatchAlarmToCloudWatchLogs(event=event, joined_alarm_name='joined_alarm', left_alarm_name='left_alarm', metric_namespace='test_namespace', metric_name='test_metric_name')
-
-        actual = obj.count()
-
-        assert actual == {'previous_count': 0, 'connected_count': 1, 'joined_count': 1, 'left_count': 0}
-
-    def test_count_for_cloudwatch_logs_metric_filter_if_function_is_called_by_joined_alarm_when_metric_has_been_to_count_up(self, mocker):
-        self._mock_to_get_metric_data(mocker, 'test_namespace', 'test_metric_name', datetime(2022, 8, 1, 14, 31), datetime(2022, 8, 1, 15, 31))
-        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', datetime(2022, 8, 1, 14), datetime(2022, 8, 1, 16), [
-            {'timestamp': datetime(2022, 8, 1, 15, 30), 'value': 1},
-        ])
-        event = _create_cloudwatch_alarm_event('joined_alarm', datetime(2022, 8, 1, 15, 31), 1.0)
-        obj = CountCommandFromCloudWatchAlarmToCloudWatchLogs(event=event, joined_alarm_name='joined_alarm', left_alarm_name='left_alarm', metric_namespace='test_namespace', metric_name='test_metric_name')
-
-        actual = obj.count()
-
-        assert actual == {'previous_count': 1, 'connected_count': 2, 'joined_count': 1, 'left_count': 0}
-
-    def test_count_for_cloudwatch_logs_metric_filter_if_function_is_called_by_joined_alarm_when_metric_has_been_to_count_up_more_than_one(self, mocker):
-        self._mock_to_get_metric_data(mocker, 'test_namespace', 'test_metric_name', datetime(2022, 8, 1, 14, 31), datetime(2022, 8, 1, 15, 31))
-        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', datetime(2022, 8, 1, 14), datetime(2022, 8, 1, 16), [
-            {'timestamp': datetime(2022, 8, 1, 15, 20), 'value': 4},
-            {'timestamp': datetime(2022, 8, 1, 15, 25), 'value': 1},
-            {'timestamp': datetime(2022, 8, 1, 15, 26), 'value': 3},
+    def test_get_previous_metric_from_cache_when_metric_has_been_got_just_before(self, monkeypatch, mocker):
+        self._mock_to_get_metric_data(monkeypatch, 'test_namespace', 'test_metric_name', _T_15, _T_16)
+        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', _T_15, _T_16, [
+            {'timestamp': _T_15_30, 'value': 1},
         ])
-        event = _create_cloudwatch_alarm_event('joined_alarm', datetime(2022, 8, 1, 15, 31), 2.0)
-        obj = CountCommandFromCloudWatchAlarmToCloudWatchLogs(event=event, joined_alarm_name='joined_alarm', left_alarm_name='left_alarm', metric_namespace='test_namespace', metric_name='test_metric_name')
-
-        actual = obj.count()
-
-        assert actual == {'previous_count': 3, 'connected_count': 5, 'joined_count': 2, 'left_count': 0}
-
-    def test_count_for_cloudwatch_logs_metric_filter_if_function_is_called_by_left_alarm_when_metric_has_not_been_to_count_down(self, mocker):
-        self._mock_to_get_metric_data(mocker, 'test_namespace', 'test_metric_name', datetime(2022, 8, 1, 14, 59), datetime(2022, 8, 1, 15, 59))
-        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', datetime(2022, 8, 1, 14), datetime(2022, 8, 1, 16), [
-            {'timestamp': datetime(2022, 8, 1, 15, 30), 'value': 1},
-        ])
-        event = _create_cloudwatch_alarm_event('left_alarm', datetime(2022, 8, 1, 15, 59), 1.0)
-        obj = CountCommandFromCloudWatchAlarmToCloudWatchLogs(event=event, joined_alarm_name='joined_alarm', left_alarm_name='left_alarm', metric_namespace='test_namespace', metric_name='test_metric_name')
+        m_get_metric_data = mocker.spy(CountCommandFromCloudWatchAlarmToCloudWatchLogs, 'get_metric_data')
+        obj = CountCommandFromCloudWatchAlarmToCloudWatchLogs(event=None, metric_namespace='test_namespace', metric_name='test_metric_name')
 
-        actual = obj.count()
+        obj.get_previous_metric()
+        actual = obj.get_previous_metric()
 
-        assert actual == {'previous_count': 1, 'connected_count': 0, 'joined_count': 0, 'left_count': 1}
+        assert actual == 1.0
+        m_get_metric_data.assert_called_once()
 
-    def test_count_for_cloudwatch_logs_metric_filter_if_function_is_called_by_left_alarm_when_metric_has_been_to_count_down(self, mocker):
-        self._mock_to_get_metric_data(mocker, 'test_namespace', 'test_metric_name', datetime(2022, 8, 1, 14, 59), datetime(2022, 8, 1, 15, 59))
-        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', datetime(2022, 8, 1, 14), datetime(2022, 8, 1, 16), [
-            {'timestamp': datetime(2022, 8, 1, 15, 30), 'value': 3},
-            {'timestamp': datetime(2022, 8, 1, 15, 31), 'value': 4},
+    def test_get_previous_metric_from_cache_when_function_has_been_counted_just_before(self, monkeypatch):
+        self._mock_to_get_metric_data(monkeypatch, 'test_namespace', 'test_metric_name', _T_14_31, _T_15_31)
+        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', _T_14, _T_16, [
+            {'timestamp': _T_15_30, 'value': 1},
         ])
-        event = _create_cloudwatch_alarm_event('left_alarm', datetime(2022, 8, 1, 15, 59), 2.0)
+        event = _create_cloudwatch_alarm_event('joined_alarm', _T_15_31, 2.0)
         obj = CountCommandFromCloudWatchAlarmToCloudWatchLogs(event=event, joined_alarm_name='joined_alarm', left_alarm_name='left_alarm', metric_namespace='test_namespace', metric_name='test_metric_name')
+        obj.count()
 
-        actual = obj.count()
-
-        assert actual == {'previous_count': 4, 'connected_count': 2, 'joined_count': 0, 'left_count': 2}
+        actual = obj.get_previous_metric()
 
-    def test_count_for_cloudwatch_logs_metric_filter_if_function_is_called_by_left_alarm_when_metric_has_been_to_count_down_more_than_one(self, mocker):
-        self._mock_to_get_metric_data(mocker, 'test_namespace', 'test_metric_name', datetime(2022, 8, 1, 14, 59), datetime(2022, 8, 1, 15, 59))
-        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', datetime(2022, 8, 1, 14), datetime(2022, 8, 1, 16), [
-            {'timestamp': datetime(2022, 8, 1, 15, 20), 'value': 4},
-            {'timestamp': datetime(2022, 8, 1, 15, 25), 'value': 1},
-            {'timestamp': datetime(2022, 8, 1, 15, 26), 'value': 3},
-        ])
-        event = _create_cloudwatch_alarm_event('left_alarm', datetime(2022, 8, 1, 15, 59), 3.0)
+        assert actual == 3
+
+    @pytest.mark.parametrize('alarm_name, timestamp, value, values, expected', [
+        ('joined_alarm', _T_15_31, 1.0, [], {'previous_count': 0, 'connected_count': 1, 'joined_count': 1, 'left_count': 0}),
+        ('joined_alarm', _T_15_31, 1.0, [
+            {'timestamp': _T_15_30, 'value': 1},
+        ], {'previous_count': 1, 'connected_count': 2, 'joined_count': 1, 'left_count': 0}),
+        ('joined_alarm', _T_15_31, 2.0, [
+            {'timestamp': _T_15_20, 'value': 4},
+            {'timestamp': _T_15_25, 'value': 1},
+            {'timestamp': _T_15_26, 'value': 3},
+        ], {'previous_count': 3, 'connected_count': 5, 'joined_count': 2, 'left_count': 0}),
+        ('left_alarm', _T_15_59, 1.0, [
+            {'timestamp': _T_15_30, 'value': 1},
+        ], {'previous_count': 1, 'connected_count': 0, 'joined_count': 0, 'left_count': 1}),
+        ('left_alarm', _T_15_59, 2.0, [
+            {'timestamp': _T_15_30, 'value': 3},
+            {'timestamp': _T_15_31, 'value': 4},
+        ], {'previous_count': 4, 'connected_count': 2, 'joined_count': 0, 'left_count': 2}),
+        ('left_alarm', _T_15_59, 3.0, [
+            {'timestamp': _T_15_20, 'value': 4},
+            {'timestamp': _T_15_25, 'value': 1},
+            {'timestamp': _T_15_26, 'value': 3},
+        ], {'previous_count': 3, 'connected_count': 0, 'joined_count': 0, 'left_count': 3}),
+    ], ids=[
+        'joined_when_metric_has_not_been_to_count_up_or_down',
+        'joined_when_metric_has_been_to_count_up',
+        'joined_when_metric_has_been_to_count_up_more_than_one',
+        'left_when_metric_has_not_been_to_count_down',
+        'left_when_metric_has_been_to_count_down',
+        'left_when_metric_has_been_to_count_down_more_than_one',
+    ])
+    def test_count_for_cloudwatch_logs_metric_filter(self, monkeypatch, alarm_name, timestamp, value, values, expected):
+        # アラーム発生時刻から1時間前までのメトリクスを取得する
+        self._mock_to_get_metric_data(monkeypatch, 'test_namespace', 'test_metric_name', timestamp - timedelta(hours=1), timestamp)
+        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', _T_14, _T_16, values)
+        event = _create_cloudwatch_alarm_event(alarm_name, timestamp, value)
         obj = CountCommandFromCloudWatchAlarmToCloudWatchLogs(event=event, joined_alarm_name='joined_alarm', left_alarm_name='left_alarm', metric_namespace='test_namespace', metric_name='test_metric_name')
 
         actual = obj.count()
 
-        assert actual == {'previous_count': 3, 'connected_count': 0, 'joined_count': 0, 'left_count': 3}
+        assert actual == expected
 
-    def test_not_count_if_cloudwatch_alarm_name_is_not_found(self, mocker):
-        self._mock_to_get_metric_data(mocker, 'test_namespace', 'test_metric_name', datetime(2022, 8, 1, 14, 31), datetime(2022, 8, 1, 15, 31))
-        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', datetime(2022, 8, 1, 14), datetime(2022, 8, 1, 16), [])
-        event = _create_cloudwatch_alarm_event('unknown_alarm', datetime(2022, 8, 1, 15, 31), 1.0)
+    def test_not_count_if_cloudwatch_alarm_name_is_not_found(self, monkeypatch):
+        self._mock_to_get_metric_data(monkeypatch, 'test_namespace', 'test_metric_name', _T_14_31, _T_15_31)
+        self._set_to_repeat_fill_metric_data('test_namespace', 'test_metric_name', _T_14, _T_16, [])
+        event = _create_cloudwatch_alarm_event('unknown_alarm', _T_15_31, 1.0)
         obj = CountCommandFromCloudWatchAlarmToCloudWatchLogs(event=event, joined_alarm_name='joined_alarm', left_alarm_name='left_alarm', metric_namespace='test_namespace', metric_name='test_metric_name')
 
         with pytest.raises(RuntimeError):
             obj.count()
 
     def test_ckeck_that_event_source_is_sns_message(self):
-        event = _create_cloudwatch_alarm_event('joined_alarm', datetime(2022, 8, 1, 15, 31), 1.0)
+        event = _create_cloudwatch_alarm_event('joined_alarm', _T_15_31, 1.0)
         obj = CountCommandFromCloudWatchAlarmToDynamoDB(event=event)
 
         actual = obj.check_event_source()
@@ -682,18 +751,16 @@ class TestCountCommandFromCloudWatchAlarmToCloudWatchLogs:
             obj.check_event_source()
 
 
-@mock_dynamodb
+@pytest.mark.usefixtures('shared_table')
 class TestCounterTable:
-    def test_add_counter(self):
-        _create_table('TestTable', 'id')
+    def test_add_counter(self, counter_table):
         obj = CounterTable('TestTable', 'id')
 
         actual = obj.update_item(1)
 
         assert actual == 1
 
-    def test_add_counter_multiple(self):
-        _create_table('TestTable', 'id')
+    def test_add_counter_multiple(self, counter_table):
         obj = CounterTable('TestTable', 'id')
 
         obj.update_item(1)
@@ -702,16 +769,14 @@ class TestCounterTable:
 
         assert actual == 6
 
-    def test_subtract_counter(self):
-        _create_table('TestTable', 'id')
+    def test_subtract_counter(self, counter_table):
         obj = CounterTable('TestTable', 'id')
 
         actual = obj.update_item(-1)
 
         assert actual == -1
 
-    def test_subtract_counter_multiple(self):
-        _create_table('TestTable', 'id')
+    def test_subtract_counter_multiple(self, counter_table):
         obj = CounterTable('TestTable', 'id')
 
         obj.update_item(3)
@@ -721,37 +786,60 @@ class TestCounterTable:
         assert actual == 0
 
     @pytest.mark.asyncio
-    async def test_count_asyncronously(self):
+    async def test_count_asyncronously(self, counter_table):
         import asyncio
 
-        with mock_dynamodb():
-            _create_table('TestTable', 'id')
-            obj = CounterTable('TestTable', 'id')
-            async def async_obj_update_item(count):
-                return await asyncio.get_event_loop().run_in_executor(None, obj.update_item, count)
+        obj = CounterTable('TestTable', 'id')
+        async def async_obj_update_item(count):
+            return await asyncio.get_event_loop().run_in_executor(None, obj.update_item, count)
 
-            actuals = await asyncio.gather(
-                async_obj_update_item(3),
-                async_obj_update_item(-2),
-                async_obj_update_item(4)
-            )
+        actuals = await asyncio.gather(
+            async_obj_update_item(3),
+            async_obj_update_item(-2),
+            async_obj_update_item(4)
+        )
 
-            assert 5 in actuals
+        assert 5 in actuals
 
 
 class TestNotificationAnalysis:
-    def test_extract_datapoint_when_current_metric_datapoint_is_one(self):
-        notification_log_from_sns = 'Threshold Crossed: 1 out of the last 1 datapoints [1.0 (13/08/22 16:10:00)] was greater than or equal to the threshold (1.0) (minimum 1 datapoint for OK -> ALARM transition).'
+    @pytest.mark.parametrize('notification_log_from_sns, expected', [
+        ('Threshold Crossed: 1 out of the last 1 datapoints [1.0 (13/08/22 16:10:00)] was greater than or equal to the threshold (1.0) (minimum 1 datapoint for OK -> ALARM transition).', 1.0),
+        ('Threshold Crossed: 1 out of the last 1 datapoints [0.0 (01/08/22 15:10:00)] was not greater than or equal to the threshold (1.0) (minimum 1 datapoint for ALARM -> OK transition).', 0.0),
+        ('Threshold Crossed: 1 out of the last 1 datapoints [2.0(01/08/22 15:10:00)] was greater than or equal to the threshold (1.0) (minimum 1 datapoint for OK -> ALARM transition).', 2.0),
+    ], ids=['one', 'zero', 'not_separated_by_space'])
+    def test_extract_datapoint(self, notification_log_from_sns, expected):
         obj = NotificationAnalysis()
 
         actual = obj.extract_datapoint(notification_log_from_sns)
 
-        assert actual == 1.0
+        assert actual == expected
 
-    def test_extract_datapoint_when_current_metric_datapoint_is_zero(self):
-        notification_log_from_sns = 'Threshold Crossed: 1 out of the last 1 datapoints [0.0 (01/08/22 15:10:00)] was not greater than or equal to the threshold (1.0) (minimum 1 datapoint for ALARM -> OK transition).'
+    @pytest.mark.parametrize('notification_log_from_sns', [
+        'Threshold Crossed: 1 out of the last 1 datapoints [nan (13/08/22 16:10:00)] was greater than or equal to the threshold (1.0) (minimum 1 datapoint for OK -> ALARM transition).',
+        'Threshold Crossed: 1 out of the last 1 datapoints [inf (13/08/22 16:10:00)] was greater than or equal to the threshold (1.0) (minimum 1 datapoint for OK -> ALARM transition).',
+        'Threshold Crossed: 1 out of the last 1 datapoints [1e3 (13/08/22 16:10:00)] was greater than or equal to the threshold (1.0) (minimum 1 datapoint for OK -> ALARM transition).',
+    ], ids=['nan', 'inf', 'exponent'])
+    def test_raise_error_if_datapoint_is_not_decimal(self, notification_log_from_sns):
         obj = NotificationAnalysis()
 
-        actual = obj.extract_datapoint(notification_log_from_sns)
+        with pytest.raises(ValueError, match='datapoint is not found'):
+            obj.extract_datapoint(notification_log_from_sns)
 
-        assert actual == 0.0
+
+class TestLazyJSONMessage:
+    def test_convert_to_json_string(self):
+        obj = LazyJSONMessage({'connected_count': 1, 'joined_count': 1, 'left_count': 0})
+
+        actual = str(obj)
+
+        assert json.loads(actual) == {'connected_count': 1, 'joined_count': 1, 'left_count': 0}
+
+    def test_not_convert_to_json_string_if_log_level_is_not_enabled(self, mocker):
+        m_dumps = mocker.patch('lib.clients_counter.json_dumps')
+        logger = logging.getLogger('test_lazy_json_message')
+        logger.setLevel(logging.WARNING)
+
+        logger.info('%s', LazyJSONMessage({'connected_count': 1}))
+
+        m_dumps.assert_not_called()
@@ -0,0 +1,70 @@
+import base64
+import gzip
+import importlib.util
+from pathlib import Path
+
+import orjson
+import pytest
+from moto import mock_cloudwatch, mock_dynamodb
+
+with mock_cloudwatch(), mock_dynamodb():
+    from lib.clients_counter import UnknownEventSource
+
+
+def _create_kinesis_event(messages):
+    data = {
+        'messageType': 'DATA_MESSAGE',
+        'logEvents': [{'id': str(i), 'timestamp': 1659367860000, 'message': m} for i, m in enumerate(messages)],
+    }
+
+    return {
+        'Records': [{
+            'kinesis': {'data': base64.b64encode(gzip.compress(orjson.dumps(data))).decode()},
+            'eventSource': 'aws:kinesis',
+        }],
+    }
+
+
+def _create_sns_event(message):
+    return {
+        'Records': [{
+            'EventSource': 'aws:sns',
+            'Sns': {'Message': orjson.dumps(message).decode()},
+        }],
+    }
+
+
+@pytest.fixture
+def app(monkeypatch, table_definition):
+    """環境変数を設定した状態で、 src/clients_counter/app.py を読み込む."""
+    table_name, primary_key_column_name = table_definition
+    monkeypatch.setenv('TABLE_NAME', table_name)
+    monkeypatch.setenv('PRIMARY_KEY_COLUMN_NAME', primary_key_column_name)
+
+    # src/switcher/app.py と同名のモジュールになるため、ファイルを指定して別名で読み込む
+    spec = importlib.util.spec_from_file_location(
+        'clients_counter_app', Path(__file__).parents[2] / 'src' / 'clients_counter' / 'app.py'
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.mark.parametrize('table_definition', [('AppTestTable', 'pk')], indirect=True)
+@pytest.mark.usefixtures('shared_table')
+class TestHandler:
+    def test_count_to_table_configured_by_environment_variables(self, app, counter_table):
+        event = _create_kinesis_event(['[15:31:00] [Server thread/INFO]: user joined the game'])
+
+        app.handler(event, None)
+        actual = counter_table.get_item(TableName='AppTestTable', Key={'pk': {'S': 'counter'}})['Item']
+
+        assert actual['count'] == {'N': '1'}
+
+    def test_raise_error_if_event_is_sns_message(self, app, counter_table):
+        event = _create_sns_event({'AlarmName': 'joined_alarm', 'NewStateReason': '[1.0 (01/08/22 15:31:00)]'})
+
+        with pytest.raises(UnknownEventSource):
+            app.handler(event, None)
+
+        assert 'Item' not in counter_table.get_item(TableName='AppTestTable', Key={'pk': {'S': 'counter'}})
@@ -0,0 +1,57 @@
+import boto3
+import pytest
+from moto import mock_dynamodb
+from moto.core import ACCOUNT_ID
+from moto.dynamodb.models import dynamodb_backends
+
+
+with mock_dynamodb():
+    # 認証情報が未設定の環境でもテストできるよう、moto のダミーの認証情報を持つクライアントとしてモック内で生成する
+    dynamodb = boto3.client('dynamodb')
+
+
+def _create_table(table_name, primary_key):
+    # boto3 クライアントによるリクエストの生成・署名を経由せず、moto のバックエンドに直接テーブルを作成する (mock_dynamodb の中で呼び出すこと)
+    dynamodb_backends[ACCOUNT_ID][dynamodb.meta.region_name].create_table(
+        table_name,
+        attr=[{'AttributeName': primary_key, 'AttributeType': 'S'}],
+        schema=[{'AttributeName': primary_key, 'KeyType': 'HASH'}],
+        throughput=None,
+        billing_mode='PAY_PER_REQUEST'
+    )
+
+
+@pytest.fixture(scope='class')
+def table_definition(request):
+    """
+    共有テーブルのテーブル名と主キーの列名.
+
+    Notes
+    -----
+    既定は ('TestTable', 'id') とし、 indirect なパラメーター化、またはテストモジュール・クラス内での同名フィクスチャの定義で変更できる。
+    """
+    return getattr(request, 'param', ('TestTable', 'id'))
+
+
+@pytest.fixture(scope='class')
+def shared_table(table_definition):
+    """
+    テストクラス内で共有するDynamoDBテーブルを1度だけ作成する.
+
+    Notes
+    -----
+    moto はモック開始時にバックエンドをリセットするため、テストメソッドごとに mock_dynamodb を開始せず、
+    テストクラスに @pytest.mark.usefixtures('shared_table') を指定してクラス全体をこのモックで覆う。
+    """
+    with mock_dynamodb():
+        _create_table(*table_definition)
+        yield dynamodb
+
+
+@pytest.fixture
+def counter_table(shared_table, table_definition):
+    """共有テーブルを利用し、前のテストで書き込まれた項目を全て削除する."""
+    table_name, primary_key = table_definition
+    for item in shared_table.scan(TableName=table_name, ProjectionExpression='#k', ExpressionAttributeNames={'#k': primary_key})['Items']:
+        shared_table.delete_item(TableName=table_name, Key=item)
+    return shared_table
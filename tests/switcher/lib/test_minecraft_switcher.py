@@ -1,6 +1,8 @@
 import boto3
-import json
+from botocore.exceptions import ClientError, EndpointConnectionError
+from functools import lru_cache
 
+import orjson
 import pytest
 from moto import (
     mock_cloudformation,
@@ -16,63 +18,58 @@ with mock_cloudformation(), mock_dynamodb():
         UserStillConnectedError,
     )
 
+    # テスト用スタックの作成や、他の実行環境からのスタック更新の再現に使い回すため、モジュール読込時に1度だけ生成する
+    cfn = boto3.client('cloudformation')
+
+
+@lru_cache(maxsize=16)
+def _create_cfn_template_body(parameter_keys):
+    """同じパラメーターキーで生成するテンプレートは、JSON文字列化済みの結果を使い回す."""
+    return orjson.dumps({
+        'AWSTemplateFormatVersion': '2010-09-09',
+        'Parameters': {k: {'Type': 'String'} for k in parameter_keys},
+        'Resources': {
+            'SampleBucket': {
+                'Type': 'AWS::S3::Bucket',
+                'Properties': {
+                    'BucketName': 'sample.bucket',
+                },
+            },
+        },
+    }).decode()
+
 
+# create_stackはS3を参照しており、同じS3バックエンドで2回以上実行すると409を返してエラーになってしまうため、テスト毎にS3もリセットする
+# https://github.com/spulec/moto/issues/4925
 @mock_cloudformation
-@mock_dynamodb
+@mock_s3
+@pytest.mark.usefixtures('shared_table')
 class TestMinecraftSwitcher:
-    dynamodb = boto3.client('dynamodb')
-
     def _create_cfn_parameters(self, parameters, is_reused=None):
         return [({
             'ParameterKey': k,
             'ParameterValue': v
         } | ({'UsePreviousValue': is_reused} if is_reused is not None else {})) for k, v in parameters.items()]
 
-    def _create_cfn_template_body(self, parameters):
-        return {
-            'AWSTemplateFormatVersion': '2010-09-09',
-            'Parameters': {k: {'Type': 'String'} for k in parameters.keys()},
-            'Resources': {
-                'SampleBucket': {
-                    'Type': 'AWS::S3::Bucket',
-                    'Properties': {
-                        'BucketName': 'sample.bucket',
-                    },
-                },
-            },
-        }
-
     def _create_cfn_stack(self, stack_name, parameters={}):
-        cfn = boto3.client('cloudformation')
-
-        with mock_s3():
-            # create_stackはS3を参照しており、2回以上実行すると409を返してエラーになってしまう
-            # https://github.com/spulec/moto/issues/4925
-            cfn.create_stack(
-                StackName=stack_name,
-                TemplateBody=json.dumps(self._create_cfn_template_body(parameters)),
-                Parameters=self._create_cfn_parameters(parameters)
-            )
-
-    def _create_table(self, table_name, primary_key):
-        self.dynamodb.create_table(
-            TableName=table_name,
-            AttributeDefinitions=[{'AttributeName': primary_key, 'AttributeType': 'S'}],
-            KeySchema=[{'AttributeName': primary_key, 'KeyType': 'HASH'}],
-            BillingMode='PAY_PER_REQUEST'
+        cfn.create_stack(
+            StackName=stack_name,
+            TemplateBody=_create_cfn_template_body(tuple(parameters)),
+            Parameters=self._create_cfn_parameters(parameters)
         )
 
-    def test_not_set_param_if_stack_name_is_null(self):
-        with pytest.raises(RuntimeError):
-            MinecraftSwitcher(None, None, None)
-
-    def test_not_set_param_if_stack_name_is_empty(self):
-        with pytest.raises(RuntimeError):
-            MinecraftSwitcher('', None, None)
+    @pytest.mark.parametrize('stack_name', [
+        pytest.param(None, id='null'),
+        pytest.param('', id='empty'),
+        pytest.param(['not', 'string', 'info'], id='not_string'),
+    ])
+    def test_not_set_param_if_stack_name_is_invalid(self, stack_name):
+        with pytest.raises(ValueError):
+            MinecraftSwitcher(stack_name, None, None)
 
-    def test_not_set_param_if_stack_name_is_not_string(self):
-        with pytest.raises(RuntimeError):
-            MinecraftSwitcher(['not', 'string', 'info'], None, None)
+    def test_not_set_param_if_primary_key_column_name_is_null_with_table_name(self):
+        with pytest.raises(ValueError):
+            MinecraftSwitcher('TestStack', 'TestTable', None)
 
     def test_get_cloudformation_one_parameter(self):
         stack_name = 'SampleStack'
@@ -175,9 +172,8 @@ class TestMinecraftSwitcher:
         with pytest.raises(NotFoundStackError):
             obj.update_cloudformation_stack(overrode_params)
 
-    def test_not_update_cloudformation_if_there_is_connected_user(self):
-        self._create_table('TestTable', 'id')
-        self.dynamodb.put_item(
+    def test_not_update_cloudformation_if_there_is_connected_user(self, counter_table):
+        counter_table.put_item(
             TableName='TestTable',
             Item={'id': {'S': 'counter'}, 'count': {'N': '1'}}
         )
@@ -187,9 +183,8 @@ class TestMinecraftSwitcher:
         with pytest.raises(UserStillConnectedError):
             obj.update_cloudformation_stack({'TestKey': 'Overrode'})
 
-    def test_update_cloudformation_if_there_is_not_connected_user(self):
-        self._create_table('TestTable', 'id')
-        self.dynamodb.put_item(
+    def test_update_cloudformation_if_there_is_not_connected_user(self, counter_table):
+        counter_table.put_item(
             TableName='TestTable',
             Item={'id': {'S': 'counter'}, 'count': {'N': '0'}}
         )
@@ -202,8 +197,7 @@ class TestMinecraftSwitcher:
 
         assert actual == expected
 
-    def test_update_cloudformation_if_there_is_not_data_from_table(self):
-        self._create_table('TestTable', 'id')
+    def test_update_cloudformation_if_there_is_not_data_from_table(self, counter_table):
         self._create_cfn_stack('TestStack', {'TestKey': 'TestValue'})
         obj = MinecraftSwitcher('TestStack', 'TestTable', 'id')
         expected = self._create_cfn_parameters({'TestKey': 'Overrode'})
@@ -213,9 +207,8 @@ class TestMinecraftSwitcher:
 
         assert actual == expected
 
-    def test_update_cloudformation_if_there_is_not_connected_item(self):
-        self._create_table('TestTable', 'id')
-        self.dynamodb.put_item(
+    def test_update_cloudformation_if_there_is_not_connected_item(self, counter_table):
+        counter_table.put_item(
             TableName='TestTable',
             Item={'id': {'S': 'ignore_data'}}
         )
@@ -228,9 +221,8 @@ class TestMinecraftSwitcher:
 
         assert actual == expected
 
-    def test_update_cloudformation_if_there_is_not_connected_data(self):
-        self._create_table('TestTable', 'id')
-        self.dynamodb.put_item(
+    def test_update_cloudformation_if_there_is_not_connected_data(self, counter_table):
+        counter_table.put_item(
             TableName='TestTable',
             Item={'id': {'S': 'counter'}, 'not_count_data': {'N': '0'}}
         )
@@ -243,9 +235,8 @@ class TestMinecraftSwitcher:
 
         assert actual == expected
 
-    def test_update_cloudformation_if_there_is_not_connected_count(self):
-        self._create_table('TestTable', 'id')
-        self.dynamodb.put_item(
+    def test_update_cloudformation_if_there_is_not_connected_count(self, counter_table):
+        counter_table.put_item(
             TableName='TestTable',
             Item={'id': {'S': 'counter'}, 'count': {'S': 'not_number_data'}}
         )
@@ -257,3 +248,80 @@ class TestMinecraftSwitcher:
         actual = obj.get_cloudformation_parameters()
 
         assert actual == expected
+
+    def test_get_cloudformation_parameters_by_injected_client(self, mocker):
+        cfn_client = mocker.Mock()
+        cfn_client.describe_stacks.return_value = {'Stacks': [{'Parameters': self._create_cfn_parameters({'TestKey': 'TestValue'})}]}
+        obj = MinecraftSwitcher('TestStack', None, None, cfn_client=cfn_client)
+        expected = self._create_cfn_parameters({'TestKey': 'TestValue'})
+
+        actual = obj.get_cloudformation_parameters()
+
+        assert actual == expected
+        cfn_client.describe_stacks.assert_called_once_with(StackName='TestStack')
+
+    def test_get_only_connected_count_when_updated_cloudformation(self, mocker):
+        cfn_client = mocker.Mock()
+        cfn_client.describe_stacks.return_value = {'Stacks': [{'Parameters': self._create_cfn_parameters({'TestKey': 'TestValue'})}]}
+        dynamodb_client = mocker.Mock()
+        dynamodb_client.get_item.return_value = {'Item': {'count': {'N': '0'}}}
+        obj = MinecraftSwitcher('TestStack', 'TestTable', 'pk', cfn_client=cfn_client, dynamodb_client=dynamodb_client)
+
+        obj.update_cloudformation_stack({'TestKey': 'Overrode'})
+
+        dynamodb_client.get_item.assert_called_once_with(
+            TableName='TestTable',
+            Key={'pk': {'S': 'counter'}},
+            ProjectionExpression='#c',
+            ExpressionAttributeNames={'#c': 'count'}
+        )
+        cfn_client.update_stack.assert_called_once()
+
+    def test_get_cloudformation_current_parameters_if_stack_has_been_updated_by_others(self):
+        self._create_cfn_stack('TestStack', {'TestKey': 'TestValue'})
+        obj = MinecraftSwitcher('TestStack', None, None)
+        obj.get_cloudformation_parameters()
+        cfn.update_stack(StackName='TestStack', UsePreviousTemplate=True, Parameters=self._create_cfn_parameters({'TestKey': 'Overrode'}))
+        expected = self._create_cfn_parameters({'TestKey': 'Overrode'})
+
+        actual = obj.get_cloudformation_parameters()
+
+        assert actual == expected
+
+    def test_raise_error_when_updated_cloudformation_if_connected_count_cannot_be_got(self, mocker):
+        dynamodb_client = mocker.Mock()
+        dynamodb_client.get_item.side_effect = ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': ''}}, 'GetItem')
+        self._create_cfn_stack('TestStack', {'TestKey': 'TestValue'})
+        obj = MinecraftSwitcher('TestStack', 'TestTable', 'id', dynamodb_client=dynamodb_client)
+        expected = self._create_cfn_parameters({'TestKey': 'TestValue'})
+
+        with pytest.raises(ClientError):
+            obj.update_cloudformation_stack({'TestKey': 'Overrode'})
+
+        assert obj.get_cloudformation_parameters() == expected
+
+    def test_raise_exception_after_checked_connected_user_when_updated_cloudformation_if_stack_cannot_be_described(self, mocker):
+        cfn_client = mocker.Mock()
+        cfn_client.describe_stacks.side_effect = ClientError({'Error': {'Code': 'ValidationError', 'Message': ''}}, 'DescribeStacks')
+        dynamodb_client = mocker.Mock()
+        dynamodb_client.get_item.return_value = {'Item': {'id': {'S': 'counter'}, 'count': {'N': '0'}}}
+        obj = MinecraftSwitcher('TestStack', 'TestTable', 'id', cfn_client=cfn_client, dynamodb_client=dynamodb_client)
+
+        with pytest.raises(NotFoundStackError):
+            obj.update_cloudformation_stack({'TestKey': 'Overrode'})
+
+        dynamodb_client.get_item.assert_called_once()
+        cfn_client.update_stack.assert_not_called()
+
+    def test_raise_error_after_checked_connected_user_when_updated_cloudformation_if_cloudformation_is_unreachable(self, mocker):
+        cfn_client = mocker.Mock()
+        cfn_client.describe_stacks.side_effect = EndpointConnectionError(endpoint_url='https://cloudformation.ap-northeast-1.amazonaws.com')
+        dynamodb_client = mocker.Mock()
+        dynamodb_client.get_item.side_effect = ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': ''}}, 'GetItem')
+        obj = MinecraftSwitcher('TestStack', 'TestTable', 'id', cfn_client=cfn_client, dynamodb_client=dynamodb_client)
+
+        with pytest.raises(EndpointConnectionError):
+            obj.update_cloudformation_stack({'TestKey': 'Overrode'})
+
+        dynamodb_client.get_item.assert_called_once()
+        cfn_client.update_stack.assert_not_called()
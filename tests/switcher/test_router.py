@@ -0,0 +1,55 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import pytest
+from moto import mock_cloudformation, mock_dynamodb
+
+with mock_cloudformation(), mock_dynamodb():
+    # router が読み込む lib.minecraft_switcher は、モジュール読込時にAWSクライアントを生成する
+    from router import HealthEndpoint, router
+
+
+@pytest.fixture(scope='module')
+def client():
+    app = FastAPI()
+    app.include_router(router)
+    return TestClient(app)
+
+
+class TestHealthEndpoint:
+    def test_get_health(self, client):
+        actual = client.get('/health')
+
+        assert actual.status_code == 200
+        assert actual.headers['content-type'] == 'application/json'
+        assert actual.headers['content-length'] == str(len(actual.content))
+        assert actual.json() == {'message': 'OK'}
+
+    @pytest.mark.parametrize('method, expected', [
+        ('GET', b'{"message":"OK"}'),
+        ('HEAD', b''),
+    ])
+    def test_send_body_only_for_get(self, method, expected):
+        # TestClient はHEADのレスポンスボディを読み捨てるため、ASGIアプリを直接呼び出して送信内容を確認する
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(HealthEndpoint()({'type': 'http', 'method': method}, None, send))
+
+        assert messages[0]['status'] == 200
+        assert (b'content-length', b'16') in messages[0]['headers']
+        assert messages[1]['body'] == expected
+
+    def test_not_allow_to_post_health(self, client):
+        actual = client.post('/health')
+
+        assert actual.status_code == 405
+
+    def test_exclude_health_from_openapi_schema(self, client):
+        actual = client.get('/openapi.json').json()
+
+        assert '/health' not in actual['paths']
+        assert '/switch/on' in actual['paths']